@@ -9,39 +9,498 @@ Credit goes to ArjanCodes
 Refer to original source code here https://github.com/ArjanCodes/betterpython/tree/main
 '''
 
+import operator
 from abc import ABC, abstractmethod
+from decimal import ROUND_HALF_EVEN, Decimal
+from types import MappingProxyType
+from weakref import ref
+
+# Lines per chunk whose partial sum Order caches, appending lines only ever re-sums the unfinished tail chunk
+CHUNK_SIZE = 4096
+
+# Size of each currency's minor unit, a hundredth unless listed
+MINOR_UNITS = {"JPY": Decimal(1), "KRW": Decimal(1)}
+HUNDREDTH = Decimal("0.01")
+
+def chunk_total(quantities, prices):
+    '''
+    Sum of one chunk of lines, module level so a process pool can pickle it
+    '''
+    return sum(map(operator.mul, quantities, prices))
+
+class Lines(list):
+    '''
+    Read-only view of one column of an order, a plain list to read but every in-place change raises.
+    Order changes its columns through the list methods themselves, e.g. list.append(lines, value).
+    '''
+
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Order lines are read-only, use add_item, update_item or remove_item")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = clear = sort = reverse = _read_only
+
+    def __reduce__(self):
+        return Lines, (self[:],)
+
+# Order's own way to grow its read-only columns
+_append = list.append
 
 class Order:
+    '''
+    items, quantities, prices and currencies are read-only, lines change through add_item, update_item or
+    remove_item. Each change bumps version and drops the memoized totals.
 
-    def __init__(self):
-        self.items = []
-        self.quantities = []
-        self.prices = []
+    Every line has a currency, the order's own currency unless given. Lines in other currencies are
+    totalled per currency and converted once per currency with the order's FX rates (see fx-rates.py).
+    Converted amounts are Decimals rounded to the minor unit of the order's currency, so the total an order
+    is settled against never carries float residue. Once a payment is attempted the order converts with the
+    factors pinned on its ledger, so new rates cannot change what was captured or what is refundable.
+
+    Most orders are small and single-currency, so the memo, the chunk sums and the per-line currencies are
+    only created once an order needs them.
+    '''
+
+    __slots__ = (
+        "items", "quantities", "prices", "_currencies", "currency", "rates", "status", "ledger", "version",
+        "cache_hits", "cache_misses", "_cache", "_foreign_lines", "_chunk_sums", "__weakref__",
+    )
+
+    # Set to an event bus, anything with publish(event, order, **data), to announce new lines
+    events = None
+
+    # Set to a concurrent.futures executor to sum many stale chunks in parallel. Only a process pool
+    # (forked, so it can import this module) runs them truly in parallel, threads are held back by the GIL.
+    executor = None
+    parallel_chunks = 8
+
+    def __init__(self, currency="USD", rates=None):
+        self.items = Lines()
+        self.quantities = Lines()
+        self.prices = Lines()
+        # Currency of every line, None while they are all in the order's currency
+        self._currencies = None
+        self.currency = currency
+        self.rates = rates
         self.status = "open"
+        self.ledger = None
+        self.version = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Memoized aggregates of this version, None until the first lookup after a change
+        self._cache = None
+        # Lines not in the order's currency, while there are none totals skip FX entirely
+        self._foreign_lines = 0
+        # Cached sums of the complete chunks, created with the first chunk. A sum is None where an edit made it stale.
+        self._chunk_sums = None
+
+    @classmethod
+    def from_lines(cls, items, quantities, prices, currencies=None, currency="USD", status="open", rates=None):
+        '''
+        Build an order from whole columns at once, e.g. when decoding orders, instead of line by line
+        '''
+        order = cls(currency, rates)
+        order.items = Lines(items)
+        order.quantities = Lines(quantities)
+        order.prices = Lines(prices)
+        order.status = status
+        if currencies is not None:
+            order._foreign_lines = len(currencies) - currencies.count(currency)
+            if order._foreign_lines:
+                order._currencies = Lines(currencies)
+        return order
+
+    def __getstate__(self):
+        # Lines travel as plain lists, which pickle several times faster, and the memo is rebuilt on demand
+        currencies = None if self._currencies is None else self._currencies[:]
+        return (
+            self.items[:], self.quantities[:], self.prices[:], currencies, self.currency, self.rates,
+            self.status, self.ledger, self.version, self.cache_hits, self.cache_misses, self._foreign_lines,
+        )
+
+    def __setstate__(self, state):
+        (items, quantities, prices, currencies, self.currency, self.rates,
+         self.status, self.ledger, self.version, self.cache_hits, self.cache_misses, self._foreign_lines) = state
+        self.items = Lines(items)
+        self.quantities = Lines(quantities)
+        self.prices = Lines(prices)
+        self._currencies = None if currencies is None else Lines(currencies)
+        self._cache = None
+        self._chunk_sums = None
+
+    @property
+    def currencies(self):
+        '''
+        Currency of every line
+        '''
+        if self._currencies is None:
+            return Lines([self.currency] * len(self.items))
+        return self._currencies
+
+    def add_item(self, name, quantity, price, currency=None):
+        _append(self.items, name)
+        _append(self.quantities, quantity)
+        _append(self.prices, price)
+        if currency is not None and currency != self.currency or self._currencies is not None:
+            self._add_currency(currency or self.currency)
+        self.version += 1
+        self._cache = None
+        if self.events is not None:
+            self.events.publish(
+                "item_added", self, name=name, quantity=quantity, price=price, currency=currency or self.currency,
+            )
+
+    def _add_currency(self, currency):
+        if self._currencies is None:
+            # The first foreign line, every earlier line is in the order's currency
+            self._currencies = Lines([self.currency] * (len(self.items) - 1))
+        _append(self._currencies, currency)
+        self._foreign_lines += currency != self.currency
+
+    def update_item(self, index, quantity=None, price=None):
+        self._check_editable()
+        index = range(len(self.prices))[index]
+        chunk = index // CHUNK_SIZE
+        if self._chunk_sums is not None and chunk < len(self._chunk_sums):
+            self._chunk_sums[chunk] = None
+        if quantity is not None:
+            list.__setitem__(self.quantities, index, quantity)
+        if price is not None:
+            list.__setitem__(self.prices, index, price)
+        self.version += 1
+        self._cache = None
+
+    def remove_item(self, index):
+        self._check_editable()
+        index = range(len(self.prices))[index]
+        # Every later line shifts down, so every chunk from here on changes
+        if self._chunk_sums is not None:
+            del self._chunk_sums[index // CHUNK_SIZE:]
+        list.__delitem__(self.items, index)
+        list.__delitem__(self.quantities, index)
+        list.__delitem__(self.prices, index)
+        if self._currencies is not None:
+            self._foreign_lines -= self._currencies[index] != self.currency
+            list.__delitem__(self._currencies, index)
+        self.version += 1
+        self._cache = None
+
+    def _check_editable(self):
+        '''
+        The ledger refers to lines by position, so lines cannot change once anything was captured.
+        New lines can still be added, they are simply not settled yet.
+        '''
+        if self.ledger is not None and self.ledger.captured:
+            raise Exception("Order has captured payments, its lines can no longer be changed")
 
-    def add_item(self, name, quantity, price):
-        self.items.append(name)
-        self.quantities.append(quantity)
-        self.prices.append(price)
+    def _memoized(self, key, compute):
+        '''
+        Return the cached aggregate for the current version, computing it on a miss
+        '''
+        cache = self._cache
+        if cache is None:
+            cache = self._cache = {}
+        elif key in cache:
+            self.cache_hits += 1
+            return cache[key]
+        self.cache_misses += 1
+        value = cache[key] = compute()
+        return value
+
+    def cache_hit_ratio(self):
+        lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits / lookups if lookups else 0.0
 
     def total_price(self):
+        '''
+        Total in the order's currency, cached per FX rate version so new rates are picked up
+        '''
+        if not self._foreign_lines:
+            return self._memoized("total_price", self._total_price)
+        if self.ledger is not None:
+            return self._memoized(("total_price", self.ledger), self._converted_total)
+        if self.rates is None:
+            raise Exception(f"Order has lines in {', '.join(sorted(self.totals_by_currency()))}, set its FX rates first")
+        return self._memoized(("total_price", self.rates, self.rates.version), self._converted_total)
+
+    def _total_price(self):
+        '''
+        Cached complete chunks plus the unfinished tail, only stale or newly completed chunks are summed
+        '''
+        if len(self.prices) < CHUNK_SIZE:
+            return chunk_total(self.quantities, self.prices)
+        if self._chunk_sums is None:
+            self._chunk_sums = []
+        sums = self._chunk_sums
+        complete = len(self.prices) // CHUNK_SIZE
+        sums.extend([None] * (complete - len(sums)))
+        stale = [chunk for chunk, total in enumerate(sums) if total is None]
+        if stale:
+            slices = [slice(chunk * CHUNK_SIZE, (chunk + 1) * CHUNK_SIZE) for chunk in stale]
+            quantities = [self.quantities[lines] for lines in slices]
+            prices = [self.prices[lines] for lines in slices]
+            if self.executor is not None and len(stale) >= self.parallel_chunks:
+                totals = self.executor.map(chunk_total, quantities, prices)
+            else:
+                totals = map(chunk_total, quantities, prices)
+            for chunk, total in zip(stale, totals):
+                sums[chunk] = total
+        tail = complete * CHUNK_SIZE
+        return sum(sums) + chunk_total(self.quantities[tail:], self.prices[tail:])
+
+    def _converted_total(self):
+        return sum(self._convert(amount, currency) for currency, amount in self._currency_totals().items())
+
+    def _convert(self, amount, currency):
+        if self.ledger is not None:
+            converted = amount * self.ledger.factor(self, currency)
+        else:
+            converted = self.rates.convert(amount, currency, self.currency)
+        return Decimal(str(converted)).quantize(MINOR_UNITS.get(self.currency, HUNDREDTH), ROUND_HALF_EVEN)
+
+    def _currency_totals(self):
+        if self._currencies is None:
+            return {self.currency: chunk_total(self.quantities, self.prices)} if self.items else {}
+        totals = {}
+        for currency, quantity, price in zip(self._currencies, self.quantities, self.prices):
+            totals[currency] = totals.get(currency, 0) + quantity * price
+        return totals
+
+    def line_total(self, index):
+        '''
+        Amount of one line in the order's currency. Lines are rounded one by one, so in an order with
+        foreign lines they can add up to a minor unit or two more or less than total_price().
+        '''
+        amount = self.quantities[index] * self.prices[index]
+        if self._foreign_lines:
+            amount = self._convert(amount, self._currencies[index])
+        return amount
+
+    def totals_by_currency(self):
+        '''
+        Read-only mapping of currency to the total of the lines in that currency
+        '''
+        return self._memoized("totals_by_currency", lambda: MappingProxyType(self._currency_totals()))
+
+    def foreign_lines(self):
+        '''
+        Number of lines not in the order's currency
+        '''
+        return self._foreign_lines
+
+    def item_count(self):
+        '''
+        Number of lines
+        '''
+        return len(self.items)
+
+    def max_line(self):
+        '''
+        (name, subtotal) of the most expensive line, or None for an empty order
+        '''
+        return self._memoized("max_line", lambda: max(
+            zip(self.items, map(operator.mul, self.quantities, self.prices)),
+            key=operator.itemgetter(1),
+            default=None,
+        ))
+
+    def subtotals(self):
+        '''
+        Read-only mapping of item name to its subtotal, lines with the same name are added together
+        '''
+        def compute():
+            subtotals = {}
+            for name, quantity, price in zip(self.items, self.quantities, self.prices):
+                subtotals[name] = subtotals.get(name, 0) + quantity * price
+            return MappingProxyType(subtotals)
+        return self._memoized("subtotals", compute)
+
+class Ledger:
+    '''
+    Amounts captured and refunded on an order, created on the order by its first payment.
+
+    Captures fill the lines front to back, so every line before `cursor` is fully settled and only the
+    cursor line can be partly settled. The amount settled per line is derived from that rather than stored,
+    which makes a payment in full a single marker. Refunds are kept per line, for refunded lines only.
+
+    The line amounts are only stable if the FX rates are, so the ledger pins the conversion factor of every
+    currency of the order when it is created, and of any currency added later when it is first converted.
+    '''
+
+    __slots__ = ("captured", "refunded_total", "cursor", "partial", "refunded", "factors")
+
+    def __init__(self):
+        self.captured = 0
+        self.refunded_total = 0
+        self.cursor = 0
+        # Amount settled on the cursor line
+        self.partial = 0
+        # Line index -> amount refunded on it
+        self.refunded = {}
+        # Currency -> factor converting it to the order's currency
+        self.factors = {}
+
+    @staticmethod
+    def of(order):
+        if order.ledger is None:
+            ledger = Ledger()
+            if order._foreign_lines:
+                for currency in order._currency_totals():
+                    ledger.factor(order, currency)
+            order.ledger = ledger
+        return order.ledger
+
+    def factor(self, order, currency):
+        factor = self.factors.get(currency)
+        if factor is None:
+            if order.rates is None:
+                raise Exception(f"Order has lines in {currency}, set its FX rates first")
+            factor = self.factors[currency] = order.rates.convert(1, currency, order.currency)
+        return factor
+
+    def settled(self, order, line):
+        '''
+        Amount settled on one line
+        '''
+        if line < self.cursor:
+            return order.line_total(line)
+        return self.partial if line == self.cursor else 0
+
+    def capture(self, order, amount):
+        '''
+        Allocate amount to the order lines, filling them front to back
+        '''
+        if self.captured + amount == order.total_price():
+            self.settle(order)
+            return
+        self.captured += amount
+        amount += self.partial
+        i = self.cursor
+        while i < len(order.prices):
+            line = order.line_total(i)
+            if amount < line:
+                break
+            amount -= line
+            i += 1
+        self.cursor = i
+        self.partial = amount
+
+    def outstanding(self, order):
+        return order.total_price() - self.captured
+
+    def settle(self, order):
+        '''
+        Record payment in full, a single marker however many lines the order has
+        '''
+        self.captured = order.total_price()
+        self.cursor = len(order.prices)
+        self.partial = 0
+
+    def refundable(self, order, lines=None):
+        '''
+        Amount settled and not yet refunded on the given line indexes, or on the whole order.
+        Never more than what is left of the capture, whatever the rounded line amounts add up to.
+        '''
+        remaining = self.captured - self.refunded_total
+        if lines is None:
+            return remaining
+        lines = {range(len(order.prices))[i] for i in lines}
+        return min(remaining, sum(self.settled(order, i) - self.refunded.get(i, 0) for i in lines))
+
+    def refund(self, order, lines=None):
+        '''
+        Record the refund of the given line indexes, or of every line, and return its amount
+        '''
+        if lines is None:
+            amount = self.refundable(order)
+            lines = range(min(self.cursor + 1, len(order.prices)))
+        else:
+            lines = {range(len(order.prices))[i] for i in lines}
+            amount = self.refundable(order, lines)
+        for i in lines:
+            self.refunded[i] = self.settled(order, i)
+        self.refunded_total += amount
+        return amount
+
+
+class ReversalBatch:
+    '''
+    Collects refunds, e.g. during the day, and submits them per processor in one go
+    '''
+
+    def __init__(self):
+        # Processor -> {order: line indexes, None for every line}
+        self.pending = {}
+
+    def add(self, processor, order, lines=None):
+        processor._refundable(order, lines)
+        reversals = self.pending.setdefault(processor, {})
+        # Several refunds of one order are merged, so each order is reversed once per submission
+        if lines is not None:
+            lines = set(lines)
+            if order in reversals:
+                lines = None if reversals[order] is None else reversals[order] | lines
+        reversals[order] = lines
+
+    def submit(self):
+        '''
+        Submit the reversals per processor. The ledgers of a processor's orders are only updated once the
+        backend accepted its submission, a declined one stays pending so submit() can be retried.
+        Orders refunded in full in the meantime are left out, a processor with nothing left submits nothing.
+        '''
         total = 0
-        for i in range(len(self.prices)):
-            total += self.quantities[i] * self.prices[i]
+        for processor in list(self.pending):
+            reversals = {
+                order: lines for order, lines in self.pending[processor].items() if order.ledger.refundable(order, lines)
+            }
+            amount = sum(order.ledger.refundable(order, lines) for order, lines in reversals.items())
+            if reversals:
+                print(f"Submitting {len(reversals)} reversals totalling {amount} via {processor.payment_type} payment type")
+                processor._submit("reverse", amount, count=len(reversals))
+                for order, lines in reversals.items():
+                    processor._reverse(order, lines)
+            del self.pending[processor]
+            total += amount
         return total
 
+
+class Transport(ABC):
+    '''
+    Carries payment requests to a backend, so processors do not depend on how the backend is reached
+    '''
+    __slots__ = ()
+
+    @abstractmethod
+    def send(self, request: dict) -> dict:
+        '''
+        Send one request and return the backend response, which has at least an "ok" flag
+        '''
+        pass
+
+
 class Authorizer(ABC):
+    __slots__ = ()
+
     @abstractmethod
     def is_authorized(self) -> bool:
         pass
 
 class SMSAuth(Authorizer):
 
-    authorized = False
+    __slots__ = ("authorized", "transport")
+
+    def __init__(self, transport: Transport = None):
+        self.authorized = False
+        self.transport = transport
 
     def verify_code(self, code):
         print(f"Verifying code: {code}")
-        self.authorized = True
+        if self.transport is None:
+            self.authorized = True
+        else:
+            self.authorized = self.transport.send({"action": "verify", "code": code})["ok"]
 
     def is_authorized(self) -> bool:
         return self.authorized
@@ -49,7 +508,10 @@ class SMSAuth(Authorizer):
 
 class NotARobot(Authorizer):
 
-    authorized = False
+    __slots__ = ("authorized",)
+
+    def __init__(self):
+        self.authorized = False
 
     def not_a_robot(self):
         print(f"You don't appear to be a robot")
@@ -62,8 +524,146 @@ class NotARobot(Authorizer):
 class PaymentProcessor(ABC):
     '''
     Create an abstract base class, which sub-classes can inherit from.
+
+    Processors use __slots__ instead of a per-instance __dict__, and identical
+    configurations can share one instance through shared()
     '''
 
+    __slots__ = ("__weakref__", "transport")
+
+    # Flyweight cache of weak references, entries disappear once no caller holds the processor anymore.
+    # A plain dict rather than a WeakValueDictionary, whose lookups run in Python and cost more than building a processor.
+    _shared = {}
+
+    # Set to an event bus, anything with publish(event, order, **data), to announce authorized, (partially) paid,
+    # (partially) refunded and failed payments
+    events = None
+
+    @classmethod
+    def shared(cls, *config):
+        '''
+        Return the processor already built for an identical configuration, or build and cache a new one.
+        Processors keep no per-payment state, so one instance can serve every order with the same config.
+        The authorizer is part of the config and compared by identity, so this only saves anything when
+        callers reuse one authorizer, not for an authorizer per customer.
+        '''
+        key = (cls, config)
+        cached = cls._shared.get(key)
+        processor = cached() if cached is not None else None
+        if processor is None:
+            processor = cls(*config)
+            cls._shared[key] = ref(processor, lambda dead, key=key: PaymentProcessor._forget(key, dead))
+        return processor
+
+    @staticmethod
+    def _forget(key, dead):
+        # A processor built again for the same key may already have replaced the dead reference
+        if PaymentProcessor._shared.get(key) is dead:
+            del PaymentProcessor._shared[key]
+
+    def authorize(self, order=None):
+        '''
+        Raise unless the processor may move money, processors without an authorizer always may
+        '''
+        authorizer = getattr(self, "authorizer", None)
+        if authorizer is not None and not authorizer.is_authorized():
+            self._publish("failed", order, reason="Not Authorized")
+            raise Exception("Not Authorized")
+        self._publish("authorized", order)
+
+    def capture(self, order, amount):
+        '''
+        Settle part of an order, it becomes paid once the captures cover its total
+        '''
+        self.authorize(order)
+        ledger = Ledger.of(order)
+        outstanding = ledger.outstanding(order)
+        if isinstance(outstanding, Decimal):
+            amount = Decimal(str(amount))
+        if not 0 < amount <= outstanding:
+            raise Exception(f"Cannot capture {amount}, outstanding amount is {outstanding}")
+        print(f"Capturing {amount} via {self.payment_type} payment type")
+        self._submit("capture", amount, order)
+        ledger.capture(order, amount)
+        if amount == outstanding:
+            order.status = "paid"
+            self._publish("paid", order)
+        else:
+            order.status = "partially paid"
+            self._publish("partially_paid", order, amount=amount)
+
+    def refund(self, order, lines=None, batch: ReversalBatch = None):
+        '''
+        Refund the settled amount of the given line indexes, or of every line.
+        With a batch the reversal is queued and only sent when the batch is submitted.
+        '''
+        if batch is not None:
+            batch.add(self, order, lines)
+            return None
+        amount = self._refundable(order, lines)
+        print(f"Refunding {amount} via {self.payment_type} payment type")
+        self._submit("refund", amount, order)
+        self._reverse(order, lines)
+        return amount
+
+    def _publish(self, event, order, **data):
+        if self.events is not None:
+            self.events.publish(event, order, payment_type=self.payment_type, **data)
+
+    def _submit(self, action, amount, order=None, **fields):
+        '''
+        Send the request to the backend and raise if it is declined, processors without a transport only print.
+        Decimal amounts travel as strings, which every wire format carries exactly.
+        '''
+        if self.transport is None:
+            return None
+        if isinstance(amount, Decimal):
+            amount = str(amount)
+        response = self.transport.send({"action": action, "type": self.payment_type, "amount": amount, **fields})
+        if not response["ok"]:
+            error = response.get("error", "declined")
+            self._publish("failed", order, reason=error)
+            raise Exception(f"Payment {action} failed: {error}")
+        return response
+
+    def _settle(self, order):
+        '''
+        Charge whatever is still outstanding and mark the order paid, an order with nothing outstanding is refused
+        '''
+        ledger = Ledger.of(order)
+        outstanding = ledger.outstanding(order)
+        if not outstanding:
+            raise Exception(f"Nothing is outstanding on this {order.status} order")
+        self._submit("pay", outstanding, order)
+        order.status = "paid"
+        ledger.settle(order)
+        self._publish("paid", order)
+
+    def _verify_security_code(self, code):
+        print(f"Verifying security code: {code}")
+
+    def _refundable(self, order, lines):
+        if order.ledger is None or not order.ledger.captured:
+            raise Exception("Nothing was captured on this order, there is nothing to refund")
+        amount = order.ledger.refundable(order, lines)
+        if not amount:
+            raise Exception("Nothing is left to refund on these lines")
+        return amount
+
+    def _reverse(self, order, lines):
+        '''
+        Record a refund the backend accepted
+        '''
+        ledger = order.ledger
+        amount = ledger.refund(order, lines)
+        if ledger.refunded_total == ledger.captured:
+            order.status = "refunded"
+            self._publish("refunded", order, amount=amount)
+        else:
+            order.status = "partially refunded"
+            self._publish("partially_refunded", order, amount=amount)
+        return amount
+
     @abstractmethod
     def pay(self, order):
         '''
@@ -71,6 +671,25 @@ class PaymentProcessor(ABC):
         '''
         pass
 
+# Payment type -> processor class, filled in by @register as each processor is defined
+PROCESSORS = {}
+
+def register(cls):
+    '''
+    Validate once, when the class is defined, that it implements every abstract method.
+    A broken processor then fails at import time rather than when the first order is paid.
+    '''
+    if cls.__abstractmethods__:
+        raise TypeError(f"{cls.__name__} does not implement {', '.join(sorted(cls.__abstractmethods__))}")
+    PROCESSORS[cls.payment_type] = cls
+    return cls
+
+def create_processor(payment_type, *config):
+    '''
+    Build the registered processor for a payment type, e.g. create_processor("debit", "2345678", authorizer)
+    '''
+    return PROCESSORS[payment_type](*config)
+
 # # Below class is no longer needed, due to using composition
 # class PaymentProcessor_SMS(PaymentProcessor):
 #     '''
@@ -84,66 +703,81 @@ class PaymentProcessor(ABC):
 #         pass
 
 
+@register
 class DebitPaymentProcesor(PaymentProcessor):
     '''
     Create a debit payment sub-class that inherits from PaymentProcessor abstract class
     to process debit payment only
     '''
 
-    def __init__(self, security_code, authorizer: Authorizer):
+    payment_type = "debit"
+    __slots__ = ("security_code", "authorizer")
+
+    def __init__(self, security_code, authorizer: Authorizer, transport: Transport = None):
         self.security_code = security_code
         self.authorizer = authorizer
+        self.transport = transport
 
     def pay(self, order):
-        if not self.authorizer.is_authorized():
-            raise Exception("Not Authorized")
+        self.authorize(order)
         print("Processing debit payment type")
-        print(f"Verifying security code: {self.security_code}")
-        order.status = "paid"
+        self._verify_security_code(self.security_code)
+        self._settle(order)
 
 
+@register
 class CreditPaymentProcesor(PaymentProcessor):
     '''
     Create a credit payment sub-class that inherits from PaymentProcessor abstract class
     to process credit payment only
     '''
 
-    def __init__(self, security_code):
+    payment_type = "credit"
+    __slots__ = ("security_code",)
+
+    def __init__(self, security_code, transport: Transport = None):
         self.security_code = security_code
+        self.transport = transport
 
     def pay(self, order):
+        self.authorize(order)
         print("Processing credit payment type")
-        print(f"Verifying security code: {self.security_code}")
-        order.status = "paid"
+        self._verify_security_code(self.security_code)
+        self._settle(order)
 
+@register
 class PaypalPaymentProcessor(PaymentProcessor):
     '''
     Create a paypal payment sub-class that inherits from PaymentProcessor abstract class
     to process paypal payment only
     '''
 
-    def __init__(self, email_address, authorizer: Authorizer):
+    payment_type = "paypal"
+    __slots__ = ("authorizer", "email_address")
+
+    def __init__(self, email_address, authorizer: Authorizer, transport: Transport = None):
         self.authorizer = authorizer
         self.email_address = email_address
+        self.transport = transport
 
     def pay(self, order):
-        if not self.authorizer.is_authorized():
-            raise Exception('Not Authorized')
+        self.authorize(order)
         print("Processing paypal payment type")
-        print(f"Verifying security code: {self.email_address}")
-        order.status = "paid"
-
-# Create order object
-order = Order()
-order.add_item("Keyboard", 1, 50)
-order.add_item("SSD", 1, 150)
-order.add_item("USB cable", 2, 5)
-
-print(order.total_price())
-authorizer = SMSAuth()
-# NotARobot auth can be added, because the classes do not depend on SMSAuth concrete class, but on Authorizer abstract class
-robot_authorizer = NotARobot()
-processor = DebitPaymentProcesor("2345678", authorizer)
-robot_authorizer.not_a_robot()
-authorizer.verify_code(465839)
-processor.pay(order)
\ No newline at end of file
+        self._verify_security_code(self.email_address)
+        self._settle(order)
+
+if __name__ == "__main__":
+    # Create order object
+    order = Order()
+    order.add_item("Keyboard", 1, 50)
+    order.add_item("SSD", 1, 150)
+    order.add_item("USB cable", 2, 5)
+
+    print(order.total_price())
+    authorizer = SMSAuth()
+    # NotARobot auth can be added, because the classes do not depend on SMSAuth concrete class, but on Authorizer abstract class
+    robot_authorizer = NotARobot()
+    processor = DebitPaymentProcesor("2345678", authorizer)
+    robot_authorizer.not_a_robot()
+    authorizer.verify_code(465839)
+    processor.pay(order)
\ No newline at end of file
@@ -0,0 +1,210 @@
+'''
+    Event Bus
+    -----
+    Order and the payment processors publish lifecycle events (item_added, authorized, paid, partially_paid,
+    refunded, partially_refunded, failed)
+    to whatever is set as their `events` attribute. EventBus hands each event to its subscribers
+    off the request path: every subscriber has a bounded queue and a worker thread that delivers
+    events in batches, so receipts, inventory and analytics never add to checkout latency.
+
+    When a subscriber falls behind its queue fills up, and the bus either blocks the publisher
+    for up to `block_timeout` seconds (backpressure) or drops the event, counting it in the metrics.
+'''
+
+import contextlib
+import io
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from loader import load
+
+solid = load()
+
+Event = namedtuple("Event", "name order data published")
+
+
+class Subscriber:
+    '''
+    One handler with its own queue and worker thread, receiving lists of events
+    '''
+
+    def __init__(self, handler, events, batch_size, flush_interval, max_queue, block_timeout):
+        self.handler = handler
+        self.events = events
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.queue = queue.Queue(max_queue)
+        self.delivered = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+        self.max_lag = 0.0
+        # Publishers on any thread count drops, the worker counts the rest
+        self._lock = threading.Lock()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def offer(self, event):
+        try:
+            if self.block_timeout:
+                self.queue.put(event, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _run(self):
+        while not (self._closed and self.queue.empty()):
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            lag = time.monotonic() - batch[0].published
+            try:
+                self.handler(batch)
+                failed = 0
+            except Exception:
+                failed = 1
+            with self._lock:
+                self.max_lag = max(self.max_lag, lag)
+                self.errors += failed
+                self.delivered += len(batch)
+                self.batches += 1
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "handler": getattr(self.handler, "__name__", repr(self.handler)),
+                "queued": self.queue.qsize(),
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "errors": self.errors,
+                "max_lag_ms": round(self.max_lag * 1000, 2),
+            }
+
+    def close(self):
+        self._closed = True
+        self._worker.join()
+
+
+class EventBus:
+    '''
+    In-process publish/subscribe for order and payment events
+    '''
+
+    def __init__(self):
+        self.subscribers = []
+        self.published = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, handler, events=None, batch_size=100, flush_interval=0.05, max_queue=10_000, block_timeout=0.0):
+        '''
+        Deliver events named in `events` (all events by default) to handler(batch), in batches of up to batch_size
+        '''
+        subscriber = Subscriber(handler, events and frozenset(events), batch_size, flush_interval, max_queue, block_timeout)
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def publish(self, event, order, **data):
+        # Orders are paid on many threads at once, and += on an attribute is not atomic
+        with self._lock:
+            self.published += 1
+        published = Event(event, order, data, time.monotonic())
+        for subscriber in self.subscribers:
+            if subscriber.events is None or event in subscriber.events:
+                subscriber.offer(published)
+
+    def metrics(self):
+        return {
+            "published": self.published,
+            "subscribers": [subscriber.metrics() for subscriber in self.subscribers],
+        }
+
+    def close(self):
+        '''
+        Deliver everything still queued and stop the workers
+        '''
+        for subscriber in self.subscribers:
+            subscriber.close()
+
+
+if __name__ == "__main__":
+    bus = EventBus()
+    solid.Order.events = bus
+    solid.PaymentProcessor.events = bus
+
+    receipts = []
+    inventory = {}
+
+    def send_receipts(batch):
+        time.sleep(0.01)
+        receipts.extend(event.order for event in batch)
+
+    def decrement_inventory(batch):
+        for event in batch:
+            inventory[event.data["name"]] = inventory.get(event.data["name"], 0) - event.data["quantity"]
+
+    refunds = []
+
+    def record_refunds(batch):
+        refunds.extend(event.data["amount"] for event in batch)
+
+    bus.subscribe(send_receipts, events={"paid"})
+    bus.subscribe(record_refunds, events={"refunded", "partially_refunded"})
+    bus.subscribe(decrement_inventory, events={"item_added"}, max_queue=100, block_timeout=0.01)
+
+    authorizer = solid.SMSAuth()
+    authorizer.authorized = True
+    processor = solid.DebitPaymentProcesor.shared("2345678", authorizer)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(5000):
+            order = solid.Order()
+            order.add_item("Keyboard", 1, 50)
+            order.add_item("SSD", 1, 150)
+            # Every tenth order is paid in two captures, every fiftieth is refunded in full
+            if i % 10:
+                processor.pay(order)
+            else:
+                processor.capture(order, 120)
+                processor.capture(order, 80)
+            if i % 50 == 0:
+                processor.refund(order)
+    checkout = time.perf_counter() - start
+    bus.close()
+
+    if len(receipts) != 5000 or refunds != [200] * 100:
+        raise Exception(f"Expected 5000 receipts and 100 refunds, got {len(receipts)} and {len(refunds)}")
+
+    # Publishers on many threads overflowing a stuck subscriber: every event is counted exactly once
+    flooded = EventBus()
+    release = threading.Event()
+    stuck = flooded.subscribe(lambda batch: release.wait(), max_queue=10)
+    publishers = [
+        threading.Thread(target=lambda: [flooded.publish("paid", None) for _ in range(5000)]) for _ in range(8)
+    ]
+    for publisher in publishers:
+        publisher.start()
+    for publisher in publishers:
+        publisher.join()
+    release.set()
+    flooded.close()
+    counts = stuck.metrics()
+    if flooded.published != 40_000 or counts["delivered"] + counts["dropped"] != 40_000:
+        raise Exception(f"Lost count of events published from several threads: {flooded.metrics()}")
+
+    print(f"5000 checkouts in {checkout * 1000:.1f} ms, {len(receipts)} receipts, inventory {inventory}")
+    print(bus.metrics())
@@ -0,0 +1,146 @@
+'''
+    Fake Gateway
+    -----
+    In-process stand-in for a payment backend, reached by the processors through the Transport interface.
+    Latency follows a configurable distribution, a share of requests fails, and throughput can be capped.
+
+    Running this script load tests every processor under concurrency and reports throughput and latency percentiles.
+
+    Usage: python fake-gateway.py [--requests N] [--concurrency C] [--latency MS] [--error-rate R] [--max-rps RPS]
+'''
+
+import argparse
+import contextlib
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from loader import load
+
+solid = load()
+
+
+def constant(seconds):
+    return lambda rng: seconds
+
+
+def exponential(mean):
+    return lambda rng: rng.expovariate(1 / mean)
+
+
+def lognormal(median, sigma=0.5):
+    '''
+    Long tailed latency, most requests near the median and a few much slower
+    '''
+    return lambda rng: median * rng.lognormvariate(0, sigma)
+
+
+class FakeGateway:
+    '''
+    Answers payment requests after a sampled latency, failing `error_rate` of them.
+    With max_rps set, requests are spaced out so the gateway never serves more than that per second.
+    '''
+
+    def __init__(self, latency=exponential(0.002), error_rate=0.0, max_rps=None, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_rps = max_rps
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self.served = 0
+        self.failed = 0
+
+    def handle(self, request: dict) -> dict:
+        with self._lock:
+            delay = self.latency(self._rng)
+            fail = self._rng.random() < self.error_rate
+            start = time.monotonic()
+            if self.max_rps:
+                start = max(start, self._next_slot)
+                self._next_slot = start + 1 / self.max_rps
+        time.sleep(max(0.0, start + delay - time.monotonic()))
+        with self._lock:
+            self.served += 1
+            self.failed += fail
+        if fail:
+            return {"ok": False, "error": "gateway error"}
+        return {"ok": True, "action": request["action"], "amount": request["amount"]}
+
+
+class InProcessTransport(solid.Transport):
+    '''
+    Hands requests straight to a gateway in the same process
+    '''
+
+    __slots__ = ("gateway",)
+
+    def __init__(self, gateway: FakeGateway):
+        self.gateway = gateway
+
+    def send(self, request: dict) -> dict:
+        return self.gateway.handle(request)
+
+
+def processors(transport):
+    authorizer = solid.SMSAuth()
+    authorizer.authorized = True
+    return {
+        "debit": solid.DebitPaymentProcesor("2345678", authorizer, transport),
+        "credit": solid.CreditPaymentProcesor("0372846", transport),
+        "paypal": solid.PaypalPaymentProcessor("monkey@gmail.com", authorizer, transport),
+    }
+
+
+def load_test(processor, requests, concurrency):
+    '''
+    Pay `requests` orders through `processor` from `concurrency` threads.
+    Returns (throughput per second, error count, sorted latencies in seconds).
+    '''
+    def one(_):
+        order = solid.Order()
+        order.add_item("Keyboard", 1, 50)
+        order.add_item("SSD", 1, 150)
+        start = time.perf_counter()
+        try:
+            processor.pay(order)
+            ok = True
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(not ok for _, ok in results)
+    return requests / elapsed, errors, latencies
+
+
+def percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=2.0, help="median latency in milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--max-rps", type=float, default=None)
+    args = parser.parse_args()
+
+    gateway = FakeGateway(lognormal(args.latency / 1000), args.error_rate, args.max_rps, seed=1)
+    print(f"{'processor':<10}{'req/s':>10}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, processor in processors(InProcessTransport(gateway)).items():
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            throughput, errors, latencies = load_test(processor, args.requests, args.concurrency)
+        p50, p95, p99 = (percentile(latencies, f) * 1000 for f in (0.5, 0.95, 0.99))
+        print(f"{name:<10}{throughput:>10.0f}{errors:>8}{p50:>9.2f}{p95:>9.2f}{p99:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
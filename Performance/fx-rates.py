@@ -0,0 +1,153 @@
+'''
+    FX Rates
+    -----
+    A cached, versioned FX rate table for multi-currency orders, loaded from a local JSON file.
+
+    The file lists how much one unit of the base currency is worth in every other currency.
+    Conversion factors are computed once per currency pair and cached. reload_if_changed() re-reads
+    the file when it changes and bumps version, which drops the cached factors and the totals
+    orders memoized with the previous rates.
+'''
+
+import json
+import os
+import time
+from decimal import ROUND_HALF_EVEN, Decimal
+
+from loader import load
+
+solid = load()
+
+RATES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fx-rates.json")
+
+
+class FxRates:
+    '''
+    Rate table an Order can use as its `rates`
+    '''
+
+    def __init__(self, path=RATES_FILE):
+        self.path = path
+        self.version = 0
+        self.base = None
+        self.rates = {}
+        self._factors = {}
+        self._mtime = None
+        self.reload()
+
+    def reload(self):
+        with open(self.path) as rates_file:
+            table = json.load(rates_file)
+        self._mtime = os.stat(self.path).st_mtime_ns
+        self.base = table["base"]
+        self.rates = table["rates"]
+        self._factors = {}
+        self.version += 1
+
+    def reload_if_changed(self):
+        '''
+        Reload when the file was modified since it was last read, returns whether it was
+        '''
+        if os.stat(self.path).st_mtime_ns == self._mtime:
+            return False
+        self.reload()
+        return True
+
+    def factor(self, source, target):
+        key = (source, target)
+        factor = self._factors.get(key)
+        if factor is None:
+            if source not in self.rates or target not in self.rates:
+                raise Exception(f"No FX rate for {source if source not in self.rates else target}")
+            factor = self._factors[key] = self.rates[target] / self.rates[source]
+        return factor
+
+    def convert(self, amount, source, target):
+        if source == target:
+            return amount
+        return amount * self.factor(source, target)
+
+    def convert_orders(self, orders, currency):
+        '''
+        Total many orders in one currency, converting each order's per currency totals
+        with factors looked up once per currency for the whole batch. Every converted amount is rounded
+        to the minor unit like Order does, so an order in `currency` gets its total_price() with these rates.
+        '''
+        quantum = solid.MINOR_UNITS.get(currency, solid.HUNDREDTH)
+        factors = {}
+        totals = []
+        for order in orders:
+            total = 0
+            for source, amount in order.totals_by_currency().items():
+                factor = factors.get(source)
+                if factor is None:
+                    factor = factors[source] = 1 if source == currency else self.factor(source, currency)
+                total += Decimal(str(amount * factor)).quantize(quantum, ROUND_HALF_EVEN)
+            totals.append(total)
+        return totals
+
+
+if __name__ == "__main__":
+    import gc
+    import random
+    import shutil
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = shutil.copy(RATES_FILE, os.path.join(directory, "fx-rates.json"))
+        rates = FxRates(path)
+        currencies = list(rates.rates)
+        rng = random.Random(1)
+
+        orders = []
+        for _ in range(100_000):
+            order = solid.Order("USD", rates)
+            # Mostly one foreign currency per order, sometimes a second one
+            sold_in = [rng.choice(currencies), rng.choice(currencies)]
+            for _ in range(rng.randint(1, 20)):
+                currency = sold_in[rng.random() < 0.2]
+                order.add_item("SSD", rng.randint(1, 5), rng.randint(1, 500), currency)
+            orders.append(order)
+        # Keep the collector from rescanning 100k orders in the middle of a measurement
+        gc.freeze()
+
+        start = time.perf_counter()
+        per_line = [
+            sum(rates.convert(q * p, c, "USD") for q, p, c in zip(o.quantities, o.prices, o.currencies))
+            for o in orders
+        ]
+        converting_every_line = time.perf_counter() - start
+
+        start = time.perf_counter()
+        totals = [order.total_price() for order in orders]
+        per_currency = time.perf_counter() - start
+
+        start = time.perf_counter()
+        [order.total_price() for order in orders]
+        memoized = time.perf_counter() - start
+
+        start = time.perf_counter()
+        bulk = rates.convert_orders(orders, "EUR")
+        in_bulk = time.perf_counter() - start
+        if rates.convert_orders(orders, "USD") != totals:
+            raise Exception("convert_orders disagrees with total_price")
+
+        # Totals are rounded to the cent once per currency, an order has at most two currencies
+        if any(abs(a - float(b)) > 0.01 for a, b in zip(per_line, totals)):
+            raise Exception("Per currency totals disagree with converting every line")
+
+        # New rates invalidate the memoized totals
+        with open(path) as rates_file:
+            table = json.load(rates_file)
+        table["rates"]["EUR"] = 0.5
+        with open(path, "w") as rates_file:
+            json.dump(table, rates_file)
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 1))
+        rates.reload_if_changed()
+        if [order.total_price() for order in orders[:100]] == totals[:100]:
+            raise Exception("Totals should follow the new rates")
+
+    print(f"converting every line:   {converting_every_line * 1000:8.1f} ms")
+    print(f"per currency, once:      {per_currency * 1000:8.1f} ms")
+    print(f"again, memoized:         {memoized * 1000:8.1f} ms")
+    print(f"bulk convert_orders:     {in_bulk * 1000:8.1f} ms")
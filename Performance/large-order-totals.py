@@ -0,0 +1,94 @@
+'''
+    Large Order Totals
+    -----
+    total_price() on a single order with hundreds of thousands of lines.
+
+    Order keeps a cached sum for every complete chunk of CHUNK_SIZE lines. A total only sums chunks that are
+    new or were edited, plus the unfinished tail chunk, so appending lines to a huge order and asking for
+    the total again costs one chunk instead of the whole order. Setting Order.executor to a process pool
+    sums many stale chunks in parallel, which only pays off when a lot of chunks are stale at once:
+    every chunk has to be pickled to a worker and back.
+'''
+
+import multiprocessing
+import operator
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from loader import load
+
+solid = load()
+
+
+def plain_total(order):
+    '''
+    The loop total_price() used before chunking
+    '''
+    total = 0
+    for i in range(len(order.prices)):
+        total += order.quantities[i] * order.prices[i]
+    return total
+
+
+def build(lines, rng):
+    return solid.Order.from_lines(
+        ["SSD"] * lines,
+        [rng.randint(1, 5) for _ in range(lines)],
+        [rng.randint(1, 500) for _ in range(lines)],
+    )
+
+
+if __name__ == "__main__":
+    import random
+
+    rng = random.Random(1)
+    appends = 1000
+    print(f"{'lines':>10}{'plain loop':>14}{'first total':>14}{'append+total':>14}{'process pool':>14}")
+
+    # Forked workers inherit the loaded module, so chunk_total unpickles without re-running the demo
+    with ProcessPoolExecutor(4, mp_context=multiprocessing.get_context("fork")) as pool:
+        pool.submit(int).result()
+        for lines in (100_000, 500_000, 2_000_000):
+            order = build(lines, rng)
+            expected = sum(map(operator.mul, order.quantities, order.prices))
+
+            start = time.perf_counter()
+            if plain_total(order) != expected:
+                raise Exception("Plain loop disagrees")
+            plain = time.perf_counter() - start
+
+            start = time.perf_counter()
+            if order.total_price() != expected:
+                raise Exception("Chunked total disagrees")
+            first = time.perf_counter() - start
+
+            # Every append invalidates the memoized total, only the tail chunk is summed again
+            start = time.perf_counter()
+            for _ in range(appends):
+                order.add_item("HDD", 1, 80)
+                order.total_price()
+            appended = (time.perf_counter() - start) / appends
+            expected += appends * 80
+
+            # Edits by negative index invalidate the chunk the line is actually in
+            for index, price in ((-solid.CHUNK_SIZE - 1, 1000), (-1, 7), (solid.CHUNK_SIZE, 3)):
+                expected += order.quantities[index] * (price - order.prices[index])
+                order.update_item(index, price=price)
+                if order.total_price() != expected:
+                    raise Exception(f"Total is stale after editing line {index}")
+            expected -= order.quantities[-solid.CHUNK_SIZE - 1] * order.prices[-solid.CHUNK_SIZE - 1]
+            order.remove_item(-solid.CHUNK_SIZE - 1)
+            if order.total_price() != expected:
+                raise Exception("Total is stale after removing a line by negative index")
+
+            # A fresh order has every chunk stale, the case the pool is for
+            order = solid.Order.from_lines(order.items, order.quantities, order.prices)
+            solid.Order.executor = pool
+            start = time.perf_counter()
+            if order.total_price() != expected:
+                raise Exception("Parallel total disagrees")
+            parallel = time.perf_counter() - start
+            solid.Order.executor = None
+
+            print(f"{lines:>10,}{plain * 1000:>11.1f} ms{first * 1000:>11.1f} ms"
+                  f"{appended * 1e6:>11.0f} us{parallel * 1000:>11.1f} ms")
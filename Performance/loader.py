@@ -0,0 +1,39 @@
+'''
+    Loader
+    -----
+    The example scripts use hyphenated file names, so they cannot be imported with a plain import statement.
+    load() executes a script by path once and caches it in sys.modules, so every script shares the same classes.
+'''
+
+import contextlib
+import importlib.util
+import io
+import pathlib
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+SOLID = "Dependency Invertion/dependency-invertion-after.py"
+
+
+def load(relative_path=SOLID, tolerate_errors=False):
+    '''
+    Load a script relative to the repository root, hiding whatever its demo code prints.
+    Some "before" examples end with a demo that raises on purpose, tolerate_errors keeps
+    the classes they defined before that point.
+    '''
+    path = ROOT / relative_path
+    name = path.stem.replace("-", "_")
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            spec.loader.exec_module(module)
+        except Exception:
+            if not tolerate_errors:
+                del sys.modules[name]
+                raise
+    return module
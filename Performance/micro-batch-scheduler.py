@@ -0,0 +1,274 @@
+'''
+    Micro-batch Scheduler
+    -----
+    Takes a stream of (order, payment type, credentials) requests and groups them into micro-batches
+    per payment type. The payments of each batch are handed to a thread pool together, so they run
+    concurrently with each other and with the batches of other payment types. Batch size and flush interval
+    adapt to the time each payment takes within its batch: they grow while payments finish under the latency
+    target and halve as soon as they do not, so a backend that slows down gets small batches rather than a
+    queue stuck behind a long one. A batch saves waking the dispatcher for every payment.
+
+    Requests for the same order are never in flight at once, so they are paid in submission order.
+    submit() returns a Future resolving to the order once its payment is done, or to the payment error.
+    A request whose Future is cancelled before its batch reaches it is dropped without being paid.
+'''
+
+import contextlib
+import io
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from loader import load
+
+solid = load()
+
+
+class BatchPolicy:
+    '''
+    Batch size and flush interval for one payment type, adjusted on the mean payment latency of every batch (AIMD)
+    '''
+
+    def __init__(self, target_latency, max_batch, max_interval):
+        self.target_latency = target_latency
+        self.max_batch = max_batch
+        self.max_interval = max_interval
+        self.batch_size = 1
+        self.interval = max_interval / 8
+        self.batches = 0
+        self.latency = 0.0
+
+    def observe(self, latency):
+        self.batches += 1
+        # Smoothed, so a single slow batch does not undo the growth of many fast ones
+        self.latency = latency if self.batches == 1 else 0.8 * self.latency + 0.2 * latency
+        if self.latency <= self.target_latency:
+            self.batch_size = min(self.max_batch, self.batch_size + 1)
+            self.interval = min(self.max_interval, self.interval * 1.1)
+        else:
+            self.batch_size = max(1, self.batch_size // 2)
+            self.interval = max(self.max_interval / 64, self.interval / 2)
+
+
+class Batch:
+    '''
+    Payments of one batch still running, and the time the finished ones took
+    '''
+
+    __slots__ = ("payment_type", "running", "paid", "elapsed")
+
+    def __init__(self, payment_type, size):
+        self.payment_type = payment_type
+        self.running = size
+        self.paid = 0
+        self.elapsed = 0.0
+
+
+class MicroBatchScheduler:
+    '''
+    Micro-batches payments per payment type and dispatches the batches concurrently
+    '''
+
+    def __init__(self, workers=8, target_latency=0.001, max_batch=64, max_interval=0.005):
+        self._pool = ThreadPoolExecutor(workers)
+        self._lock = threading.Condition()
+        self._queues = {payment_type: deque() for payment_type in solid.PROCESSORS}
+        self._policies = {payment_type: BatchPolicy(target_latency, max_batch, max_interval) for payment_type in solid.PROCESSORS}
+        # Order -> requests waiting behind the one already queued or in flight for that order
+        self._waiting = {}
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, order, payment_type, *credentials) -> Future:
+        '''
+        Queue a payment, e.g. submit(order, "debit", "2345678", authorizer)
+        '''
+        if payment_type not in self._queues:
+            raise Exception(f"Unknown payment type: {payment_type}")
+        future = Future()
+        request = (order, payment_type, credentials, future, time.monotonic())
+        with self._lock:
+            if self._closed:
+                raise Exception("Scheduler is closed")
+            if order in self._waiting:
+                self._waiting[order].append(request)
+            else:
+                self._waiting[order] = deque()
+                self._queues[payment_type].append(request)
+                self._lock.notify()
+        return future
+
+    def _dispatch(self):
+        with self._lock:
+            while not (self._closed and not any(self._queues.values()) and not self._waiting):
+                now = time.monotonic()
+                wait = min(policy.max_interval for policy in self._policies.values())
+                for payment_type, pending in self._queues.items():
+                    policy = self._policies[payment_type]
+                    # Every full or overdue batch goes now, not one per wake-up
+                    while pending:
+                        due = pending[0][4] + policy.interval
+                        if len(pending) < policy.batch_size and now < due and not self._closed:
+                            wait = min(wait, due - now)
+                            break
+                        size = min(policy.batch_size, len(pending))
+                        batch = Batch(payment_type, size)
+                        for _ in range(size):
+                            self._pool.submit(self._run, batch, pending.popleft())
+                self._lock.wait(max(wait, 0.0001))
+
+    def _run(self, batch, request):
+        order, _, credentials, future, _ = request
+        paid = False
+        start = time.monotonic()
+        try:
+            # A cancelled request is dropped, it is never charged
+            if future.set_running_or_notify_cancel():
+                paid = True
+                try:
+                    processor = solid.PROCESSORS[batch.payment_type].shared(*credentials)
+                    processor.pay(order)
+                    future.set_result(order)
+                except Exception as error:
+                    future.set_exception(error)
+        finally:
+            # Always released, or the requests behind this order and close() would wait forever
+            with self._lock:
+                if paid:
+                    batch.paid += 1
+                    batch.elapsed += time.monotonic() - start
+                batch.running -= 1
+                if not batch.running and batch.paid:
+                    self._policies[batch.payment_type].observe(batch.elapsed / batch.paid)
+                waiting = self._waiting[order]
+                if waiting:
+                    request = waiting.popleft()
+                    self._queues[request[1]].append(request)
+                    self._lock.notify()
+                else:
+                    del self._waiting[order]
+                    # close() waits for the last order to be released
+                    if self._closed:
+                        self._lock.notify()
+
+    def stats(self):
+        with self._lock:
+            return {
+                payment_type: {"batch_size": policy.batch_size, "interval_ms": round(policy.interval * 1000, 3), "batches": policy.batches}
+                for payment_type, policy in self._policies.items()
+            }
+
+    def close(self):
+        '''
+        Flush everything queued, wait for it to finish and stop the dispatcher
+        '''
+        with self._lock:
+            self._closed = True
+            self._lock.notify()
+        self._dispatcher.join()
+        self._pool.shutdown()
+
+
+if __name__ == "__main__":
+    import random
+
+    class Backend(solid.Transport):
+        '''
+        Pretends every request takes `latency` seconds on the wire, and counts them and how many overlap
+        '''
+        __slots__ = ("latency", "sent", "in_flight", "max_in_flight", "_lock")
+
+        def __init__(self, latency):
+            self.latency = latency
+            self.sent = 0
+            self.in_flight = 0
+            self.max_in_flight = 0
+            self._lock = threading.Lock()
+
+        def send(self, request):
+            with self._lock:
+                self.sent += 1
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            time.sleep(self.latency)
+            with self._lock:
+                self.in_flight -= 1
+            return {"ok": True}
+
+    def order_of(price):
+        order = solid.Order()
+        order.add_item("SSD", 1, price)
+        return order
+
+    def closed(scheduler):
+        # close() on a thread, so a scheduler that never drains fails the demo instead of hanging it
+        closing = threading.Thread(target=scheduler.close, daemon=True)
+        closing.start()
+        closing.join(5)
+        return not closing.is_alive()
+
+    rng = random.Random(1)
+    authorizer = solid.SMSAuth()
+    authorizer.authorized = True
+
+    # A cancelled request is never paid and does not keep close() waiting
+    backend = Backend(0.0002)
+    scheduler = MicroBatchScheduler()
+    order = order_of(100)
+    with contextlib.redirect_stdout(io.StringIO()):
+        first = scheduler.submit(order, "credit", "0372846", backend)
+        second = scheduler.submit(order, "credit", "0372846", backend)
+        if not second.cancel():
+            raise Exception("A request queued behind another one should be cancellable")
+        if not closed(scheduler):
+            raise Exception("close() hangs after a request was cancelled")
+    if first.result() is not order or backend.sent != 1:
+        raise Exception("The cancelled request should not have been paid")
+
+    # The payments of one batch reach the backend together rather than one after another
+    backend = Backend(0.02)
+    scheduler = MicroBatchScheduler()
+    scheduler._policies["credit"].batch_size = 8
+    with contextlib.redirect_stdout(io.StringIO()):
+        batch = [scheduler.submit(order_of(100), "credit", "0372846", backend) for _ in range(8)]
+        for future in batch:
+            future.result()
+        if not closed(scheduler):
+            raise Exception("close() hangs")
+    if backend.max_in_flight != len(batch):
+        raise Exception(f"{backend.max_in_flight} of the {len(batch)} payments in a batch were in flight at once")
+
+    # A backend fast enough for the latency target grows batches, a slow one gets them halved
+    print(f"{'backend':>10}{'requests':>10}{'elapsed':>12}  batch sizes")
+    for latency in (0.0002, 0.002):
+        backend = Backend(latency)
+        credentials = {
+            "debit": ("2345678", authorizer, backend),
+            "credit": ("0372846", backend),
+            "paypal": ("monkey@gmail.com", authorizer, backend),
+        }
+        orders = [order_of(rng.randint(1, 500)) for _ in range(2000 if latency < 0.001 else 300)]
+
+        scheduler = MicroBatchScheduler()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            futures = []
+            for order in orders:
+                payment_type = rng.choice(list(credentials))
+                futures.append(scheduler.submit(order, payment_type, *credentials[payment_type]))
+                # A second payment on the same order must run after the first one, so it finds the order paid
+                futures.append(scheduler.submit(order, payment_type, *credentials[payment_type]))
+            for first, second in zip(futures[::2], futures[1::2]):
+                first.result()
+                if second.exception() is None:
+                    raise Exception("Paying an order twice should be refused")
+            elapsed = time.perf_counter() - start
+            if not closed(scheduler):
+                raise Exception("close() hangs")
+
+        if any(order.status != "paid" for order in orders) or backend.sent != len(orders):
+            raise Exception("Every order should be paid exactly once")
+        sizes = {payment_type: stats["batch_size"] for payment_type, stats in scheduler.stats().items()}
+        print(f"{latency * 1000:>7.1f} ms{len(futures):>10}{elapsed * 1000:>9.0f} ms  {sizes}")
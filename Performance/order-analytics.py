@@ -0,0 +1,255 @@
+'''
+    Order Analytics
+    -----
+    Revenue by item, top N items and totals per payment status over large sets of orders.
+
+    OrderAnalytics hash-aggregates orders as they are added and keeps the aggregates up to date,
+    so a query never re-walks the orders. Top N uses a heap instead of sorting every item.
+    For orders already held as flat columns (e.g. decoded by order-codec.py), from_columns()
+    aggregates with map/zip over whole columns rather than order by order.
+
+    Revenue and status totals are kept per currency, amounts in different currencies are never added up.
+    Orders need no FX rates to be added, convert the per currency figures with fx-rates.py where needed.
+
+    An order added with a key, e.g. its id, can later be moved to a new status with update(). Only the key and
+    the order's totals are kept, never the order, and an order is forgotten once it reaches a final status.
+'''
+
+import heapq
+import operator
+import time
+from itertools import accumulate, islice
+
+from loader import load
+
+solid = load()
+
+
+# Statuses an order never leaves, orders in them are not kept for update()
+FINAL_STATUSES = frozenset({"refunded"})
+
+
+class OrderAnalytics:
+    '''
+    Running aggregates over every order added so far
+    '''
+
+    def __init__(self):
+        # Currency -> item name -> revenue
+        self.revenue = {}
+        self.quantity = {}
+        # Status -> currency -> total
+        self.status_totals = {}
+        # Key -> status and key -> totals by currency, of the orders added with a key whose status can still
+        # change. Two dicts of strings and numbers rather than one of tuples, the garbage collector skips them.
+        self._statuses = {}
+        self._totals = {}
+
+    def add(self, order, key=None):
+        '''
+        Fold an order in, its lines are counted once and must not change afterwards.
+        Pass a key to move the order to another status with update(key, status) later.
+        '''
+        if key is not None and key in self._statuses:
+            raise Exception(f"Order {key!r} was already added, call update() when its status changes")
+        revenues = self.revenue
+        quantity = self.quantity
+        amounts = map(operator.mul, order.quantities, order.prices)
+        if not order.foreign_lines():
+            # Every line in the order's own currency, the common case
+            revenue = revenues.get(order.currency)
+            if revenue is None:
+                revenue = revenues[order.currency] = {}
+            total = 0
+            for name, count, amount in zip(order.items, order.quantities, amounts):
+                revenue[name] = revenue.get(name, 0) + amount
+                quantity[name] = quantity.get(name, 0) + count
+                total += amount
+            totals = {order.currency: total}
+        else:
+            totals = {}
+            for name, count, amount, currency in zip(order.items, order.quantities, amounts, order.currencies):
+                revenue = revenues.setdefault(currency, {})
+                revenue[name] = revenue.get(name, 0) + amount
+                quantity[name] = quantity.get(name, 0) + count
+                totals[currency] = totals.get(currency, 0) + amount
+        if key is not None and order.status not in FINAL_STATUSES:
+            self._statuses[key] = order.status
+            self._totals[key] = totals
+        self._count(order.status, totals, 1)
+
+    def add_many(self, orders, keys=None):
+        if keys is None:
+            for order in orders:
+                self.add(order)
+        else:
+            for order, key in zip(orders, keys):
+                self.add(order, key)
+
+    def update(self, key, status):
+        '''
+        Move the totals of the order added under key to its new status, e.g. after it was paid
+        '''
+        if key not in self._statuses:
+            raise Exception(f"No order {key!r} whose status can change was added")
+        filed = self._statuses[key]
+        if status != filed:
+            totals = self._totals[key]
+            self._count(filed, totals, -1)
+            self._count(status, totals, 1)
+            if status in FINAL_STATUSES:
+                del self._statuses[key], self._totals[key]
+            else:
+                self._statuses[key] = status
+
+    def _count(self, status, totals, sign):
+        status_totals = self.status_totals.setdefault(status, {})
+        for currency, total in totals.items():
+            status_totals[currency] = status_totals.get(currency, 0) + sign * total
+
+    def currencies(self):
+        return sorted(self.revenue)
+
+    def revenue_by_item(self, currency="USD"):
+        return dict(self.revenue.get(currency, {}))
+
+    def top_items(self, n, by="quantity", currency="USD"):
+        '''
+        The n items with the highest quantity, or revenue in one currency, as (name, value) pairs
+        '''
+        values = self.quantity if by == "quantity" else self.revenue.get(currency, {})
+        return heapq.nlargest(n, values.items(), key=operator.itemgetter(1))
+
+    def paid_vs_open(self, currency="USD"):
+        return {status: self.status_totals.get(status, {}).get(currency, 0) for status in ("paid", "open")}
+
+    @classmethod
+    def from_columns(cls, names, quantities, prices, line_counts, statuses, currencies=None, currency="USD"):
+        '''
+        Aggregate a batch stored as one flat column per field, with line_counts and statuses per order.
+        currencies is the currency of every line, without it every line is in `currency`.
+        '''
+        analytics = cls()
+        amounts = list(map(operator.mul, quantities, prices))
+        if currencies is None:
+            revenue = analytics.revenue[currency] = {}
+            for name, count, amount in zip(names, quantities, amounts):
+                revenue[name] = revenue.get(name, 0) + amount
+                analytics.quantity[name] = analytics.quantity.get(name, 0) + count
+            running = [0, *accumulate(amounts)]
+            bounds = [0, *accumulate(line_counts)]
+            for status, start, end in zip(statuses, bounds, islice(bounds, 1, None)):
+                analytics._count(status, {currency: running[end] - running[start]}, 1)
+            return analytics
+        for name, count, amount, line_currency in zip(names, quantities, amounts, currencies):
+            revenue = analytics.revenue.setdefault(line_currency, {})
+            revenue[name] = revenue.get(name, 0) + amount
+            analytics.quantity[name] = analytics.quantity.get(name, 0) + count
+        # Status totals per order first, so they are counted once per order rather than once per line
+        bounds = [0, *accumulate(line_counts)]
+        for status, start, end in zip(statuses, bounds, islice(bounds, 1, None)):
+            totals = {}
+            for line_currency, amount in zip(currencies[start:end], amounts[start:end]):
+                totals[line_currency] = totals.get(line_currency, 0) + amount
+            analytics._count(status, totals, 1)
+        return analytics
+
+
+if __name__ == "__main__":
+    import random
+    import weakref
+
+    rng = random.Random(1)
+    names = [f"item-{i}" for i in range(1000)]
+    orders = []
+    for _ in range(200_000):
+        order = solid.Order()
+        for _ in range(rng.randint(1, 8)):
+            order.add_item(rng.choice(names), rng.randint(1, 5), rng.randint(1, 500))
+        order.status = rng.choice(["open", "paid"])
+        orders.append(order)
+
+    start = time.perf_counter()
+    revenue = {}
+    quantity = {}
+    totals = {"paid": 0, "open": 0}
+    for order in orders:
+        for i in range(len(order.prices)):
+            revenue[order.items[i]] = revenue.get(order.items[i], 0) + order.quantities[i] * order.prices[i]
+            quantity[order.items[i]] = quantity.get(order.items[i], 0) + order.quantities[i]
+        totals[order.status] += order.total_price()
+    top = sorted(quantity.items(), key=operator.itemgetter(1), reverse=True)[:10]
+    loops = time.perf_counter() - start
+
+    start = time.perf_counter()
+    analytics = OrderAnalytics()
+    analytics.add_many(orders)
+    aggregated = time.perf_counter() - start
+
+    # Keyed by position, so statuses can be updated below
+    start = time.perf_counter()
+    analytics = OrderAnalytics()
+    analytics.add_many(orders, keys=range(len(orders)))
+    keyed = time.perf_counter() - start
+
+    columns = (
+        [name for order in orders for name in order.items],
+        [count for order in orders for count in order.quantities],
+        [price for order in orders for price in order.prices],
+        [len(order.items) for order in orders],
+        [order.status for order in orders],
+    )
+    start = time.perf_counter()
+    columnar = OrderAnalytics.from_columns(*columns)
+    vectorized = time.perf_counter() - start
+
+    for result in (analytics, columnar):
+        if result.revenue_by_item() != revenue or result.paid_vs_open() != totals:
+            raise Exception("Analytics disagree with the plain loops")
+        if [value for _, value in result.top_items(10)] != [value for _, value in top]:
+            raise Exception("Top items disagree with the plain loops")
+
+    start = time.perf_counter()
+    for key, order in enumerate(orders[:1000]):
+        order.status = "paid"
+        analytics.update(key, order.status)
+    analytics.paid_vs_open()
+    analytics.top_items(10)
+    incremental = time.perf_counter() - start
+    totals = {"paid": 0, "open": 0}
+    for order in orders:
+        totals[order.status] += order.total_price()
+    if analytics.paid_vs_open() != totals:
+        raise Exception("Updated status totals disagree with the orders")
+
+    try:
+        analytics.add(orders[0], key=0)
+    except Exception:
+        pass
+    else:
+        raise Exception("Adding an order twice should fail")
+    # Refunded orders cannot change status anymore and are forgotten
+    analytics.update(0, "refunded")
+    if 0 in analytics._statuses or analytics.status_totals["refunded"]["USD"] != orders[0].total_price():
+        raise Exception("A refunded order should be counted as refunded and forgotten")
+    # The aggregates outlive the orders, which analytics must not keep alive
+    first = weakref.ref(orders[0])
+    del orders, order
+    if first() is not None:
+        raise Exception("Analytics should not keep orders alive")
+
+    # Lines are aggregated per currency, including decoded orders that have no FX rates to total them
+    mixed = solid.Order.from_lines(["SSD", "SSD"], [1, 2], [150, 20000], ["USD", "JPY"], status="paid")
+    analytics = OrderAnalytics()
+    analytics.add(mixed)
+    columnar = OrderAnalytics.from_columns(mixed.items, mixed.quantities, mixed.prices, [2], ["paid"], mixed.currencies)
+    for result in (analytics, columnar):
+        if (result.revenue_by_item() != {"SSD": 150} or result.revenue_by_item("JPY") != {"SSD": 40000}
+                or result.paid_vs_open("JPY") != {"paid": 40000, "open": 0} or result.currencies() != ["JPY", "USD"]):
+            raise Exception("Amounts in different currencies should be kept apart")
+
+    print(f"plain loops:        {loops * 1000:8.1f} ms")
+    print(f"hash aggregation:   {aggregated * 1000:8.1f} ms")
+    print(f"  keyed:            {keyed * 1000:8.1f} ms")
+    print(f"columnar:           {vectorized * 1000:8.1f} ms")
+    print(f"1000 paid + query:  {incremental * 1000:8.1f} ms")
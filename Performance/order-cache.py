@@ -0,0 +1,99 @@
+'''
+    Order Cache
+    -----
+    Checks Order's memoized aggregates (total_price, max_line, subtotals, totals_by_currency) against
+    recomputing them, across add_item, update_item and remove_item, and reports the cache hit ratio
+    and the speedup for a read-heavy workload.
+'''
+
+import operator
+import random
+import time
+
+from loader import load
+
+solid = load()
+
+NAMES = [f"item-{i}" for i in range(50)]
+
+
+def recomputed(order):
+    '''
+    The aggregates computed from scratch, as the memoized methods return them
+    '''
+    amounts = list(map(operator.mul, order.quantities, order.prices))
+    subtotals = {}
+    for name, amount in zip(order.items, amounts):
+        subtotals[name] = subtotals.get(name, 0) + amount
+    max_line = max(zip(order.items, amounts), key=operator.itemgetter(1), default=None)
+    return sum(amounts), max_line, subtotals, len(order.items)
+
+
+def memoized(order):
+    return order.total_price(), order.max_line(), dict(order.subtotals()), order.item_count()
+
+
+def build(seed):
+    rng = random.Random(seed)
+    orders = []
+    for _ in range(2000):
+        order = solid.Order()
+        for _ in range(rng.randint(1, 40)):
+            order.add_item(rng.choice(NAMES), rng.randint(1, 5), rng.randint(1, 500))
+        orders.append(order)
+    return orders
+
+
+def workload(orders, read, seed):
+    '''
+    Mostly reads, with an edit now and then, as a cart page or a checkout flow would do. Edits count lines
+    from the end half of the time, so negative indexes are exercised too.
+    '''
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    for _ in range(200_000):
+        order = orders[rng.randrange(len(orders))]
+        roll = rng.random()
+        lines = len(order.items)
+        if roll < 0.02:
+            order.add_item(NAMES[rng.randrange(len(NAMES))], 1, 100)
+        elif roll < 0.04:
+            index = rng.randrange(-lines, lines)
+            order.update_item(index, quantity=order.quantities[index] + 1)
+        elif roll < 0.05 and lines > 1:
+            order.remove_item(rng.randrange(-lines, lines))
+        else:
+            read(order)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    uncached_orders = build(1)
+    uncached = workload(uncached_orders, recomputed, 2)
+    orders = build(1)
+    cached = workload(orders, memoized, 2)
+
+    if [memoized(order) for order in orders] != [recomputed(order) for order in uncached_orders]:
+        raise Exception("Memoized aggregates disagree with recomputing them")
+    if any(order.totals_by_currency() != {"USD": order.total_price()} for order in orders):
+        raise Exception("totals_by_currency disagrees with total_price")
+
+    # Editing the lines behind the memo's back would leave it stale, so the lines are read-only
+    order = orders[0]
+    total = order.total_price()
+    for edit in (lambda: order.prices.__setitem__(0, 10**6), lambda: order.quantities.append(1), order.items.clear):
+        try:
+            edit()
+        except TypeError:
+            continue
+        raise Exception("Order lines should only change through add_item, update_item or remove_item")
+    if order.total_price() != total or order.total_price() != recomputed(order)[0]:
+        raise Exception("A refused edit changed the order")
+
+    hits = sum(order.cache_hits for order in orders)
+    misses = sum(order.cache_misses for order in orders)
+    ratios = sorted(order.cache_hit_ratio() for order in orders)
+    print(f"recomputed:  {uncached * 1000:8.1f} ms")
+    print(f"memoized:    {cached * 1000:8.1f} ms")
+    print(f"hit ratio:   {hits / (hits + misses):8.1%} overall, {ratios[len(ratios) // 2]:.1%} median order, "
+          f"{ratios[0]:.1%} lowest")
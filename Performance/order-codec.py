@@ -0,0 +1,359 @@
+'''
+    Order Codec
+    -----
+    Compact binary encoding for orders and their payment status, built on struct and array.
+
+    A buffer holds any number of orders, stored column by column across the whole batch as typed arrays.
+    Item names and statuses are stored once in a shared string table. Every column is a tagged, length-prefixed
+    section, so a decoder skips sections added by newer schema versions instead of failing on them.
+
+    Orders carry their payment ledger, so a decoded order that was partly paid is only charged what is still
+    outstanding. Ledger amounts go into the string table with a type prefix, which keeps ints, floats and the
+    Decimals of converted amounts exact. So do the FX factors a ledger pinned, a decoded order keeps settling
+    against the rates it was paid with.
+
+    Quantities and prices are int arrays when every value is an int and a double array when every value is a
+    float. A column mixing types, e.g. one float price in a batch of ints or Decimal prices, is also written as
+    type-tagged text in the string table, which decoders read instead of the doubles so every value keeps its type.
+
+    Running this script compares size and round-trip speed against pickle and JSON.
+'''
+
+import json
+import pickle
+import struct
+import sys
+import time
+from array import array
+from decimal import Decimal
+
+from loader import load
+
+solid = load()
+
+MAGIC = b"ORD"
+SCHEMA_VERSION = 5
+
+HEADER = struct.Struct("<3sBII")  # magic, schema version, order count, section count
+SECTION = struct.Struct("<BcI")  # section tag, array typecode, payload length
+
+# Sections of schema version 1, newer versions may add sections that older decoders skip
+STRING_LENGTHS, STRING_BYTES, STATUSES, LINE_COUNTS, NAMES, QUANTITIES, PRICES = range(1, 8)
+# Added in schema version 2, version 1 buffers decode with every line in DEFAULT_CURRENCY
+ORDER_CURRENCIES, LINE_CURRENCIES = 8, 9
+# Added in schema version 3, orders paid before it decode without a ledger.
+# Per order with a ledger: its position, cursor, three amounts (captured, refunded, partial) and refunded lines.
+LEDGER_ORDERS, LEDGER_CURSORS, LEDGER_AMOUNTS, REFUND_COUNTS, REFUND_LINES, REFUND_AMOUNTS = range(10, 16)
+# Added in schema version 4, ledgers written before it decode without pinned FX factors.
+# Per ledger: the number of pinned currencies, then each currency with its factor.
+FACTOR_COUNTS, FACTOR_CURRENCIES, FACTOR_VALUES = range(16, 19)
+# Added in schema version 5, only for quantity or price columns mixing value types. Older decoders read the
+# QUANTITIES and PRICES doubles written alongside, with ints and Decimals turned into floats.
+QUANTITY_TEXTS, PRICE_TEXTS = 19, 20
+INT_COLUMNS = (
+    STRING_LENGTHS, STATUSES, LINE_COUNTS, NAMES, QUANTITIES, PRICES, ORDER_CURRENCIES, LINE_CURRENCIES,
+    LEDGER_ORDERS, LEDGER_CURSORS, LEDGER_AMOUNTS, REFUND_COUNTS, REFUND_LINES, REFUND_AMOUNTS,
+    FACTOR_COUNTS, FACTOR_CURRENCIES, FACTOR_VALUES, QUANTITY_TEXTS, PRICE_TEXTS,
+)
+
+DEFAULT_CURRENCY = "USD"
+
+# Narrowest array typecode holding every value, so small quantities and prices take one or two bytes
+INT_TYPECODES = [("b", -2**7, 2**7), ("h", -2**15, 2**15), ("i", -2**31, 2**31), ("q", -2**63, 2**63)]
+
+
+AMOUNT_TYPES = {"i": int, "f": float, "d": Decimal}
+
+
+def _amount_text(amount):
+    return f"{type(amount).__name__[0].lower()}{amount!s}"
+
+
+def _amount(text):
+    return AMOUNT_TYPES[text[0]](text[1:])
+
+
+def _typecode(values):
+    if not all(type(value) is int for value in values):
+        return "d"
+    low, high = min(values, default=0), max(values, default=0)
+    for typecode, minimum, limit in INT_TYPECODES:
+        if minimum <= low and high < limit:
+            return typecode
+    raise Exception("Integer too large for the order codec")
+
+
+def _numbers(tag, texts_tag, values, strings):
+    '''
+    Sections for a quantity or price column, adding its values as text when their types are mixed
+    '''
+    typecode = _typecode(values)
+    sections = [_section(tag, values, typecode)]
+    if typecode == "d" and not all(type(value) is float for value in values):
+        sections.append(_section(texts_tag, [strings.setdefault(_amount_text(value), len(strings)) for value in values]))
+    return sections
+
+
+def _section(tag, values, typecode=None):
+    if typecode is None:
+        typecode = _typecode(values)
+    column = array(typecode, values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    payload = column.tobytes()
+    return SECTION.pack(tag, typecode.encode(), len(payload)) + payload
+
+
+def encode_many(orders):
+    '''
+    Encode orders into one buffer, as one column per field across the whole batch
+    '''
+    strings = {}
+    statuses = []
+    line_counts = []
+    names = []
+    quantities = []
+    prices = []
+    order_currencies = []
+    line_currencies = []
+    ledger_orders = []
+    ledger_cursors = []
+    ledger_amounts = []
+    refund_counts = []
+    refund_lines = []
+    refund_amounts = []
+    factor_counts = []
+    factor_currencies = []
+    factor_values = []
+    for position, order in enumerate(orders):
+        statuses.append(strings.setdefault(order.status, len(strings)))
+        line_counts.append(len(order.items))
+        names.extend([strings.setdefault(name, len(strings)) for name in order.items])
+        quantities.extend(order.quantities)
+        prices.extend(order.prices)
+        order_currencies.append(strings.setdefault(order.currency, len(strings)))
+        line_currencies.extend([strings.setdefault(currency, len(strings)) for currency in order.currencies])
+        ledger = order.ledger
+        if ledger is not None:
+            ledger_orders.append(position)
+            ledger_cursors.append(ledger.cursor)
+            for amount in (ledger.captured, ledger.refunded_total, ledger.partial):
+                ledger_amounts.append(strings.setdefault(_amount_text(amount), len(strings)))
+            refund_counts.append(len(ledger.refunded))
+            refund_lines.extend(ledger.refunded)
+            refund_amounts.extend([strings.setdefault(_amount_text(amount), len(strings)) for amount in ledger.refunded.values()])
+            factor_counts.append(len(ledger.factors))
+            factor_currencies.extend([strings.setdefault(currency, len(strings)) for currency in ledger.factors])
+            factor_values.extend([strings.setdefault(_amount_text(factor), len(strings)) for factor in ledger.factors.values()])
+
+    numbers = _numbers(QUANTITIES, QUANTITY_TEXTS, quantities, strings) + _numbers(PRICES, PRICE_TEXTS, prices, strings)
+    encoded = [value.encode() for value in strings]
+    blob = b"".join(encoded)
+    sections = [
+        _section(STRING_LENGTHS, [len(value) for value in encoded]),
+        SECTION.pack(STRING_BYTES, b"B", len(blob)) + blob,
+        _section(STATUSES, statuses),
+        _section(LINE_COUNTS, line_counts),
+        _section(NAMES, names),
+        *numbers,
+        _section(ORDER_CURRENCIES, order_currencies),
+        _section(LINE_CURRENCIES, line_currencies),
+        _section(LEDGER_ORDERS, ledger_orders),
+        _section(LEDGER_CURSORS, ledger_cursors),
+        _section(LEDGER_AMOUNTS, ledger_amounts),
+        _section(REFUND_COUNTS, refund_counts),
+        _section(REFUND_LINES, refund_lines),
+        _section(REFUND_AMOUNTS, refund_amounts),
+        _section(FACTOR_COUNTS, factor_counts),
+        _section(FACTOR_CURRENCIES, factor_currencies),
+        _section(FACTOR_VALUES, factor_values),
+    ]
+    return HEADER.pack(MAGIC, SCHEMA_VERSION, len(statuses), len(sections)) + b"".join(sections)
+
+
+def decode_many(data):
+    '''
+    Decode every order in a buffer written by encode_many, with this or a newer schema version
+    '''
+    data = memoryview(data)
+    magic, version, count, section_count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise Exception("Not an order buffer")
+    offset = HEADER.size
+
+    columns = {}
+    for _ in range(section_count):
+        tag, typecode, length = SECTION.unpack_from(data, offset)
+        offset += SECTION.size
+        if tag == STRING_BYTES:
+            columns[tag] = data[offset:offset + length]
+        elif tag in INT_COLUMNS:
+            column = array(typecode.decode())
+            column.frombytes(data[offset:offset + length])
+            if sys.byteorder == "big":
+                column.byteswap()
+            columns[tag] = column.tolist()
+        offset += length
+
+    strings = []
+    position = 0
+    blob = columns[STRING_BYTES]
+    for length in columns[STRING_LENGTHS]:
+        strings.append(str(blob[position:position + length], "utf-8"))
+        position += length
+
+    names = [strings[name] for name in columns[NAMES]]
+    quantities = columns[QUANTITIES]
+    if QUANTITY_TEXTS in columns:
+        quantities = [_amount(strings[text]) for text in columns[QUANTITY_TEXTS]]
+    prices = columns[PRICES]
+    if PRICE_TEXTS in columns:
+        prices = [_amount(strings[text]) for text in columns[PRICE_TEXTS]]
+    if ORDER_CURRENCIES in columns:
+        order_currencies = [strings[currency] for currency in columns[ORDER_CURRENCIES]]
+        line_currencies = [strings[currency] for currency in columns[LINE_CURRENCIES]]
+    else:
+        order_currencies = [DEFAULT_CURRENCY] * count
+        line_currencies = [DEFAULT_CURRENCY] * len(names)
+    orders = []
+    start = 0
+    for status, lines, currency in zip(columns[STATUSES], columns[LINE_COUNTS], order_currencies):
+        end = start + lines
+        orders.append(solid.Order.from_lines(
+            names[start:end], quantities[start:end], prices[start:end], line_currencies[start:end], currency, strings[status],
+        ))
+        start = end
+
+    if LEDGER_ORDERS in columns:
+        amounts = iter(columns[LEDGER_AMOUNTS])
+        lines = iter(columns[REFUND_LINES])
+        refunded = iter(columns[REFUND_AMOUNTS])
+        factor_counts = columns.get(FACTOR_COUNTS, [0] * len(columns[LEDGER_ORDERS]))
+        currencies = iter(columns.get(FACTOR_CURRENCIES, ()))
+        factors = iter(columns.get(FACTOR_VALUES, ()))
+        for position, cursor, refunds, pinned in zip(
+            columns[LEDGER_ORDERS], columns[LEDGER_CURSORS], columns[REFUND_COUNTS], factor_counts,
+        ):
+            ledger = orders[position].ledger = solid.Ledger()
+            ledger.cursor = cursor
+            ledger.captured, ledger.refunded_total, ledger.partial = (_amount(strings[next(amounts)]) for _ in range(3))
+            ledger.refunded = {next(lines): _amount(strings[next(refunded)]) for _ in range(refunds)}
+            ledger.factors = {strings[next(currencies)]: _amount(strings[next(factors)]) for _ in range(pinned)}
+    return orders
+
+
+def encode(order):
+    return encode_many([order])
+
+
+def decode(data):
+    return decode_many(data)[0]
+
+
+def _as_dict(order):
+    ledger = order.ledger
+    if ledger is not None:
+        ledger = [_amount_text(ledger.captured), _amount_text(ledger.refunded_total), ledger.cursor, _amount_text(ledger.partial),
+                  [[line, _amount_text(amount)] for line, amount in ledger.refunded.items()],
+                  {currency: _amount_text(factor) for currency, factor in ledger.factors.items()}]
+    return {
+        "items": order.items,
+        "quantities": order.quantities,
+        "prices": order.prices,
+        "currencies": order.currencies,
+        "currency": order.currency,
+        "status": order.status,
+        "ledger": ledger,
+    }
+
+
+def _from_dict(fields):
+    ledger = fields.pop("ledger")
+    order = solid.Order.from_lines(**fields)
+    if ledger is not None:
+        captured, refunded_total, cursor, partial, refunded, factors = ledger
+        order.ledger = solid.Ledger()
+        order.ledger.captured = _amount(captured)
+        order.ledger.refunded_total = _amount(refunded_total)
+        order.ledger.cursor = cursor
+        order.ledger.partial = _amount(partial)
+        order.ledger.refunded = {line: _amount(amount) for line, amount in refunded}
+        order.ledger.factors = {currency: _amount(factor) for currency, factor in factors.items()}
+    return order
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import random
+
+    rates = load("Performance/fx-rates.py").FxRates()
+    processor = solid.CreditPaymentProcesor("0372846")
+    rng = random.Random(1)
+    names = ["Keyboard", "SSD", "USB cable", "Monitor", "Mouse", "Headset"]
+    orders = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(20_000):
+            order = solid.Order("USD", rates)
+            for _ in range(rng.randint(1, 8)):
+                order.add_item(rng.choice(names), rng.randint(1, 5), rng.randint(1, 500), rng.choice(["USD", "USD", "EUR"]))
+            # Open, paid, partly paid, or paid and partly refunded
+            outcome = rng.randrange(4)
+            if outcome == 1:
+                processor.pay(order)
+            elif outcome == 2:
+                processor.capture(order, order.total_price() // 3 + 1)
+            elif outcome == 3:
+                processor.pay(order)
+                processor.refund(order, lines=[0])
+            orders.append(order)
+
+    same = lambda decoded: [_as_dict(order) for order in decoded] == [_as_dict(order) for order in orders]
+    codecs = {
+        "binary": (encode_many, decode_many),
+        "pickle": (pickle.dumps, pickle.loads),
+        "json": (lambda batch: json.dumps([_as_dict(order) for order in batch]).encode(),
+                 lambda data: [_from_dict(fields) for fields in json.loads(data)]),
+    }
+    print(f"{'codec':<8}{'bytes/order':>13}{'encode ms':>11}{'decode ms':>11}")
+    for name, (dump, read) in codecs.items():
+        start = time.perf_counter()
+        data = dump(orders)
+        encoded = time.perf_counter() - start
+        start = time.perf_counter()
+        decoded = read(data)
+        elapsed = time.perf_counter() - start
+        if not same(decoded):
+            raise Exception(f"{name} round trip changed the orders")
+        print(f"{name:<8}{len(data) / len(orders):>13.1f}{encoded * 1000:>11.1f}{elapsed * 1000:>11.1f}")
+
+    # A decoded partly paid order is only charged what is still outstanding, at the rates it was paid with
+    moved = load("Performance/fx-rates.py").FxRates()
+    moved.rates = dict(moved.rates, EUR=moved.rates["EUR"] * 2)
+    decoded = decode_many(encode_many(orders))
+    for original, order in zip(orders, decoded):
+        if original.status == "partially paid":
+            order.rates = moved
+            if order.ledger.outstanding(order) != original.ledger.outstanding(original):
+                raise Exception("Decoded ledger disagrees on the outstanding amount")
+
+    # Prices keep their type in a batch mixing ints, floats and Decimals, including an int-only batch
+    mixed = solid.Order()
+    mixed.add_item("SSD", 1, 150)
+    mixed.add_item("Cable", 2, 9.99)
+    mixed.add_item("Keyboard", 1.5, Decimal("49.95"))
+    for batch in ([mixed], [orders[0]]):
+        for order in decode_many(encode_many(batch)):
+            original = batch[0]
+            if [*map(type, order.prices), *map(type, order.quantities)] != [*map(type, original.prices), *map(type, original.quantities)]:
+                raise Exception("Decoding changed the type of a price or quantity")
+            if _as_dict(order) != _as_dict(original):
+                raise Exception("Decoding changed a price or quantity")
+
+    # A buffer from a newer schema with an extra section still decodes
+    data = bytearray(encode(orders[0]))
+    data[3] = SCHEMA_VERSION + 1
+    struct.pack_into("<I", data, 8, HEADER.unpack_from(data, 0)[3] + 1)
+    data += SECTION.pack(99, b"B", 3) + b"new"
+    if _as_dict(decode(bytes(data))) != _as_dict(orders[0]):
+        raise Exception("Newer schema versions should stay readable")
@@ -0,0 +1,229 @@
+'''
+    Order Store
+    -----
+    Keeps orders in memory, hash-partitioned by order id across N shards with one lock per shard.
+    Operations on orders in different shards never wait for each other, unlike a global dict behind a single lock.
+
+    pay() does not hold the shard lock during the backend round trip. The order is marked as being paid instead,
+    and only operations that would change that order wait for the payment to finish.
+
+    Running this script benchmarks one shard (a single global lock) against 16 shards across thread counts:
+    without a backend, against one that takes a millisecond per request, and with the shard lock held for the
+    whole payment. Under the GIL the dict operations are over long before another thread wants the lock,
+    so 16 shards measure the same as one in the first two cases. Sharding pays off once a lock is held
+    across slow work: with the lock held through the backend call, 16 shards reach 2 to 4 times the
+    throughput of one from 4 threads on. pay() not holding the lock is what makes one shard enough here.
+'''
+
+import contextlib
+import os
+import random
+import threading
+import time
+
+from loader import load
+
+solid = load()
+
+
+class OrderStore:
+    '''
+    Sharded order store, every operation only locks the shard owning the order id
+    '''
+
+    def __init__(self, shards=16):
+        self._locks = [threading.Condition() for _ in range(shards)]
+        self._shards = [{} for _ in range(shards)]
+        # Ids of the orders being paid, per shard
+        self._paying = [set() for _ in range(shards)]
+
+    def _shard(self, order_id):
+        index = hash(order_id) % len(self._shards)
+        return self._locks[index], self._shards[index], self._paying[index]
+
+    def put(self, order_id, order):
+        lock, orders, _ = self._shard(order_id)
+        with lock:
+            orders[order_id] = order
+
+    def get(self, order_id, default=None):
+        lock, orders, _ = self._shard(order_id)
+        with lock:
+            return orders.get(order_id, default)
+
+    def pop(self, order_id, default=None):
+        lock, orders, _ = self._shard(order_id)
+        with lock:
+            return orders.pop(order_id, default)
+
+    def __len__(self):
+        return sum(len(orders) for orders in self._shards)
+
+    def scan(self):
+        '''
+        Yield (order_id, order) pairs shard by shard.
+        Each shard is copied under its own lock, so a scan never blocks the whole store at once.
+        '''
+        for lock, orders in zip(self._locks, self._shards):
+            with lock:
+                snapshot = list(orders.items())
+            yield from snapshot
+
+    def add_item(self, order_id, name, quantity, price):
+        '''
+        Add a line to a stored order, creating the order on first use
+        '''
+        lock, orders, paying = self._shard(order_id)
+        with lock:
+            # Waiting releases the shard lock, only this order waits for its payment
+            while order_id in paying:
+                lock.wait()
+            order = orders.get(order_id)
+            if order is None:
+                order = orders[order_id] = solid.Order()
+            order.add_item(name, quantity, price)
+
+    def total_price(self, order_id):
+        lock, orders, _ = self._shard(order_id)
+        with lock:
+            return orders[order_id].total_price()
+
+    def pay(self, order_id, processor: solid.PaymentProcessor):
+        '''
+        Pay a stored order. No line can be added to it mid-payment, but the shard stays available to other orders.
+        '''
+        lock, orders, paying = self._shard(order_id)
+        with lock:
+            while order_id in paying:
+                lock.wait()
+            order = orders[order_id]
+            paying.add(order_id)
+        try:
+            processor.pay(order)
+        finally:
+            with lock:
+                paying.discard(order_id)
+                lock.notify_all()
+
+
+class Backend(solid.Transport):
+    '''
+    Answers every request after `latency` seconds, like a payment gateway across the network
+    '''
+    __slots__ = ("latency",)
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def send(self, request):
+        time.sleep(self.latency)
+        return {"ok": True}
+
+
+class LockedPayStore(OrderStore):
+    '''
+    Holds the shard lock for the whole payment, backend call included, for comparison
+    '''
+
+    def pay(self, order_id, processor):
+        lock, orders, _ = self._shard(order_id)
+        with lock:
+            processor.pay(orders[order_id])
+
+
+def benchmark(shards, threads, latency=None, operations=20_000, orders=1_000, store_class=OrderStore):
+    '''
+    Operations per second with `threads` workers mixing add_item, total_price and pay on random orders,
+    paying through a backend with `latency` seconds per request if given
+    '''
+    store = store_class(shards)
+    authorizer = solid.SMSAuth()
+    authorizer.authorized = True
+    processor = solid.DebitPaymentProcesor("2345678", authorizer, Backend(latency) if latency else None)
+    per_thread = operations // threads
+
+    def work(seed):
+        rng = random.Random(seed)
+        for _ in range(per_thread):
+            order_id = rng.randrange(orders)
+            roll = rng.random()
+            if roll < 0.6 or store.get(order_id) is None:
+                store.add_item(order_id, "SSD", 1, 150)
+            elif roll < 0.9:
+                store.total_price(order_id)
+            else:
+                # An order nobody added to since its last payment has nothing outstanding and is refused
+                with contextlib.suppress(Exception):
+                    store.pay(order_id, processor)
+
+    workers = [threading.Thread(target=work, args=(seed,)) for seed in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return per_thread * threads / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    class HeldBackend(solid.Transport):
+        '''
+        Holds every request until released, and tells when one arrived
+        '''
+        __slots__ = ("arrived", "release")
+
+        def __init__(self):
+            self.arrived = threading.Event()
+            self.release = threading.Event()
+
+        def send(self, request):
+            self.arrived.set()
+            if not self.release.wait(5):
+                raise Exception("The backend was never released")
+            return {"ok": True}
+
+    # A line added to an order being paid waits for the payment, other orders in the same shard do not
+    store = OrderStore(1)
+    store.add_item(1, "SSD", 1, 150)
+    store.add_item(2, "SSD", 1, 150)
+    authorizer = solid.SMSAuth()
+    authorizer.authorized = True
+    backend = HeldBackend()
+    held = solid.DebitPaymentProcesor("2345678", authorizer, backend)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        payment = threading.Thread(target=store.pay, args=(1, held))
+        payment.start()
+        if not backend.arrived.wait(5):
+            raise Exception("The payment never reached the backend")
+        # Order 1 is now mid-payment, and stays so until the backend is released
+        other_order = threading.Thread(target=store.add_item, args=(2, "HDD", 1, 80))
+        other_order.start()
+        other_order.join(5)
+        same_order = threading.Thread(target=store.add_item, args=(1, "HDD", 1, 80))
+        same_order.start()
+        same_order.join(0.05)
+        waited = same_order.is_alive()
+        backend.release.set()
+        payment.join()
+        same_order.join()
+    order = store.get(1)
+    if other_order.is_alive() or not waited or order.ledger.outstanding(order) != 80:
+        raise Exception("Only the order being paid should wait for its payment")
+
+    print(f"{'':>8}{'no backend':>24}{'1 ms backend':>24}{'1 ms backend, lock held':>24}")
+    print(f"{'threads':>8}" + f"{'1 shard':>12}{'16 shards':>12}" * 3 + "  ops/s")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        rows = [
+            (
+                threads,
+                benchmark(1, threads),
+                benchmark(16, threads),
+                benchmark(1, threads, 0.001, operations=4_000),
+                benchmark(16, threads, 0.001, operations=4_000),
+                benchmark(1, threads, 0.001, operations=4_000, store_class=LockedPayStore),
+                benchmark(16, threads, 0.001, operations=4_000, store_class=LockedPayStore),
+            )
+            for threads in (1, 2, 4, 8, 16)
+        ]
+    for threads, *throughput in rows:
+        print(f"{threads:>8}" + "".join(f"{ops:>12.0f}" for ops in throughput))
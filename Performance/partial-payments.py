@@ -0,0 +1,191 @@
+'''
+    Partial Payments
+    -----
+    Checks the ledger behind capture(), refund() and ReversalBatch end to end against a backend that can
+    decline requests, and measures what recording a payment costs.
+
+    A payment in full is a single marker on the ledger, captures fill lines front to back and only refunded
+    lines are stored, so pay() costs the same whatever the size of the order once its total is known.
+'''
+
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from decimal import Decimal
+
+from loader import load
+
+solid = load()
+
+
+class Backend(solid.Transport):
+    '''
+    Accepts every request except the actions listed in `declined`, and keeps the accepted ones
+    '''
+    __slots__ = ("declined", "accepted")
+
+    def __init__(self):
+        self.declined = set()
+        self.accepted = []
+
+    def send(self, request):
+        if request["action"] in self.declined:
+            return {"ok": False, "error": f"{request['action']} declined"}
+        self.accepted.append((request["action"], request["amount"]))
+        return {"ok": True}
+
+
+def expect_error(action, *args, **kwargs):
+    try:
+        action(*args, **kwargs)
+    except Exception as error:
+        return str(error)
+    raise Exception(f"{action.__name__}{args} should have failed")
+
+
+def check(condition):
+    if not condition:
+        raise Exception("Ledger check failed")
+
+
+def order_of(*amounts):
+    order = solid.Order()
+    for i, amount in enumerate(amounts):
+        order.add_item(f"item-{i}", 1, amount)
+    return order
+
+
+if __name__ == "__main__":
+    backend = Backend()
+    processor = solid.CreditPaymentProcesor("0372846", backend)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Partial captures settle lines front to back
+        order = order_of(10, 1000, 40)
+        processor.capture(order, 500)
+        check(order.status == "partially paid" and order.ledger.outstanding(order) == 550)
+        check([order.ledger.settled(order, i) for i in range(3)] == [10, 490, 0])
+        expect_error(processor.capture, order, 551)
+        processor.capture(order, 550)
+        check(order.status == "paid" and order.ledger.outstanding(order) == 0)
+
+        # Lines cannot move under the ledger once something is captured, new lines are simply unsettled
+        expect_error(order.remove_item, 0)
+        expect_error(order.update_item, 1, price=1)
+        order.add_item("late", 1, 5)
+        check(order.ledger.outstanding(order) == 5)
+        processor.pay(order)
+
+        # Partial refunds, a line is only ever refunded once
+        check(processor.refund(order, lines=[1]) == 1000 and order.status == "partially refunded")
+        check(processor.refund(order, lines=[1, -1]) == 5)
+        check(processor.refund(order) == 50 and order.status == "refunded")
+        # Nothing is sent for an order with nothing left to refund or to pay, and it stays refunded
+        sent = len(backend.accepted)
+        expect_error(processor.refund, order)
+        expect_error(processor.pay, order)
+        check(order.status == "refunded" and len(backend.accepted) == sent)
+
+        # Nothing captured, nothing to refund
+        expect_error(processor.refund, order_of(10))
+        expect_error(solid.ReversalBatch().add, processor, order_of(10))
+
+        # A declined refund leaves the ledger and status as they were
+        order = order_of(100, 50)
+        processor.pay(order)
+        backend.declined = {"refund"}
+        expect_error(processor.refund, order)
+        check(order.status == "paid" and order.ledger.refunded_total == 0)
+        backend.declined = set()
+
+        # Batches merge refunds of one order, keep a declined submission pending and send it on retry
+        batch = solid.ReversalBatch()
+        other = order_of(30)
+        processor.pay(other)
+        processor.refund(order, lines=[0], batch=batch)
+        processor.refund(order, lines=[1], batch=batch)
+        processor.refund(other, batch=batch)
+        backend.declined = {"reverse"}
+        expect_error(batch.submit)
+        check(batch.pending and order.status == "paid" and other.status == "paid")
+        backend.declined = set()
+        check(batch.submit() == 180 and not batch.pending)
+        check(order.status == other.status == "refunded")
+        check(backend.accepted[-1] == ("reverse", 180))
+
+        # An order refunded directly while queued is left out of the submission
+        order, other = order_of(10), order_of(20)
+        processor.pay(order)
+        processor.pay(other)
+        processor.refund(order, batch=batch)
+        processor.refund(other, batch=batch)
+        processor.refund(order)
+        check(batch.submit() == 20 and backend.accepted[-1] == ("reverse", 20))
+        other = order_of(20)
+        processor.pay(other)
+        processor.refund(other, batch=batch)
+        processor.refund(other)
+        check(batch.submit() == 0 and backend.accepted[-1] == ("refund", 20) and not batch.pending)
+
+        # New FX rates change neither what a paid order owes nor what its lines refund
+        fx = load("Performance/fx-rates.py")
+        with tempfile.TemporaryDirectory() as directory:
+            path = shutil.copy(fx.RATES_FILE, os.path.join(directory, "fx-rates.json"))
+            rates = fx.FxRates(path)
+            order = solid.Order("USD", rates)
+            order.add_item("Jacket", 1, 100, "EUR")
+            order.add_item("Scarf", 1, 20)
+            processor.capture(order, 50)
+            with open(path) as rates_file:
+                table = json.load(rates_file)
+            table["rates"]["EUR"] = 0.63
+            with open(path, "w") as rates_file:
+                json.dump(table, rates_file)
+            os.utime(path, ns=(time.time_ns(), time.time_ns() + 1))
+            check(rates.reload_if_changed())
+            check(order.ledger.outstanding(order) == order.line_total(0) + 20 - 50)
+            processor.pay(order)
+            captured = order.ledger.captured
+            rates.reload()
+            check(order.ledger.outstanding(order) == 0 and order.total_price() == captured)
+            expect_error(processor.capture, order, 1)
+            check(order.ledger.refundable(order, [0]) == order.line_total(0) == Decimal("108.70"))
+            check(processor.refund(order) == captured)
+
+        # Cost of recording a payment in full, against the same checkout without any ledger
+        class UnrecordedDebit(solid.DebitPaymentProcesor):
+            __slots__ = ()
+
+            def _settle(self, order):
+                self._submit("pay", 0, order)
+                order.status = "paid"
+                self._publish("paid", order)
+
+        authorizer = solid.SMSAuth()
+        authorizer.authorized = True
+        debit = solid.DebitPaymentProcesor("2345678", authorizer)
+        unrecorded = UnrecordedDebit("2345678", authorizer)
+
+        timings = {}
+        for lines in (2, 1000):
+            orders = [order_of(*range(1, lines + 1)) for _ in range(2000)]
+            for order in orders:
+                order.total_price()
+            for name, pay in (("ledger", debit.pay), ("no ledger", unrecorded.pay)):
+                best = None
+                for _ in range(5):
+                    for order in orders:
+                        order.ledger = None
+                    start = time.perf_counter()
+                    for order in orders:
+                        pay(order)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                timings[name, lines] = best
+
+    for (name, lines), seconds in timings.items():
+        print(f"pay(), {name:<10}{lines:>6} lines {seconds / 2000 * 1e6:8.2f} us")
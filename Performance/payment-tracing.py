@@ -0,0 +1,303 @@
+'''
+    Payment Tracing
+    -----
+    Opt-in span tracing of checkouts, to see whether a slow payment spent its time in is_authorized(),
+    SMSAuth.verify_code, security code verification, the backend call or the status update.
+
+    Tracer().start() is the way to leave tracing on in production: a background thread installs the wrappers
+    on the entry points (every processor's pay, capture and refund, and SMSAuth.verify_code) for `window`
+    seconds out of every `every` seconds, 1 ms a second by default, starting at a random phase. Calls outside
+    the windows run the classes untouched. The first call after a window closes uninstalls the wrappers
+    itself, as the background thread may only get the GIL a switch interval (5 ms) later. A traced
+    in-process checkout is about six times slower than an untraced one, so the overhead stays within
+    window / every times that, under 1% at the default.
+
+    install() keeps the wrappers on until uninstall(), tracing every call by default, which is meant for
+    debugging. With a sample_rate below 1 each call is sampled with that probability, but an unsampled call
+    still pays for the wrapper and one random number, about 0.15 us, which is over 10% of an in-process
+    checkout, so it is no substitute for start().
+
+    For a traced call the tracer sets a profile function on the calling thread for the duration of the call,
+    which records a span for every method of Order, Ledger, Authorizer, PaymentProcessor and Transport the
+    call runs through. Calls that enter while the wrappers are installed are traced to the end, so every span
+    in the buffer is complete.
+
+    Spans go into a fixed-size ring buffer. Writers claim a slot with next() on an itertools.count, which is
+    atomic, so recording needs no lock and the oldest spans are overwritten once the buffer is full.
+    export() writes Chrome trace-event JSON, which chrome://tracing and Perfetto open directly.
+'''
+
+import functools
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+from loader import load
+
+solid = load()
+
+# Classes whose methods become spans, together with every subclass defined when install() runs
+TRACED_CLASSES = {
+    solid.Order: "order",
+    solid.Ledger: "order",
+    solid.Authorizer: "authorizer",
+    solid.PaymentProcessor: "processor",
+    solid.Transport: "transport",
+}
+
+
+def _subclasses(cls):
+    yield cls
+    for subclass in cls.__subclasses__():
+        yield from _subclasses(subclass)
+
+
+class Tracer:
+    '''
+    Traces checkouts and keeps their spans in a ring buffer of `capacity` spans
+    '''
+
+    def __init__(self, sample_rate=1.0, capacity=65_536):
+        self.sample_rate = sample_rate
+        self.capacity = capacity
+        self._spans = [None] * capacity
+        self._slots = itertools.count()
+        self._watched = {}
+        # (class, name, method, wrapper) for every entry point, and those currently installed
+        self._wrappers = []
+        self._installed = []
+        # perf_counter() time the current window closes, calls entering after it run untraced
+        self._deadline = math.inf
+        self._stopped = threading.Event()
+        self._sampler = None
+
+    def install(self):
+        '''
+        Trace calls until uninstall(). Classes defined afterwards are only traced after calling install() again.
+        '''
+        self.uninstall()
+        self._prepare()
+        self._deadline = math.inf
+        self._apply()
+
+    def uninstall(self):
+        for cls, name, method, _ in reversed(self._installed):
+            setattr(cls, name, method)
+        self._installed = []
+
+    def _prepare(self):
+        '''
+        Find the traced methods and build the wrappers, once per install() or start() rather than per window
+        '''
+        # A new dict rather than an update, traces still running from before keep the one they started with
+        self._watched = {
+            member.__code__: (f"{cls.__name__}.{name}", category)
+            for base, category in TRACED_CLASSES.items()
+            for cls in _subclasses(base)
+            for name, member in vars(cls).items()
+            if hasattr(member, "__code__")
+        }
+        entry_points = [
+            (cls, name)
+            for cls in _subclasses(solid.PaymentProcessor)
+            for name in ("pay", "capture", "refund")
+            if name in vars(cls)
+        ]
+        entry_points += [(cls, "verify_code") for cls in _subclasses(solid.SMSAuth) if "verify_code" in vars(cls)]
+        self._wrappers = [(cls, name, vars(cls)[name], self._wrap(vars(cls)[name])) for cls, name in entry_points]
+
+    def _apply(self):
+        for cls, name, _, traced in self._wrappers:
+            setattr(cls, name, traced)
+        self._installed = self._wrappers
+
+    def start(self, every=1.0, window=0.001):
+        '''
+        Trace for `window` seconds out of every `every` seconds until stop(), the mode to use in production
+        '''
+        self.stop()
+        self.uninstall()
+        self._prepare()
+        self._stopped.clear()
+
+        def sample():
+            # A random phase, so the first window does not wait a whole period and windows do not
+            # line up with whatever runs periodically
+            delay = random.uniform(0, every - window)
+            while not self._stopped.wait(delay):
+                self._deadline = time.perf_counter() + window
+                self._apply()
+                self._stopped.wait(window)
+                self.uninstall()
+                delay = every - window
+
+        self._sampler = threading.Thread(target=sample, daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        if self._sampler is not None:
+            self._stopped.set()
+            self._sampler.join()
+            self._sampler = None
+
+    def _wrap(self, method):
+        trace = self._trace
+        sampled = random.random
+        getprofile = sys.getprofile
+        clock = time.perf_counter
+
+        @functools.wraps(method)
+        def traced(*args, **kwargs):
+            # Calls made inside a trace are recorded by its profile function already.
+            # The cheaper test goes first, most calls are not sampled.
+            if sampled() < self.sample_rate and getprofile() is None:
+                if clock() < self._deadline:
+                    return trace(method, args, kwargs)
+                # The window is over, but the background thread may still be waiting for the GIL to uninstall
+                self.uninstall()
+            return method(*args, **kwargs)
+
+        return traced
+
+    def _trace(self, method, args, kwargs):
+        watched = self._watched
+        spans = self._spans
+        capacity = self.capacity
+        slots = self._slots
+        clock = time.perf_counter_ns
+        thread = threading.get_ident()
+        started = []
+
+        def profile(frame, event, arg):
+            if event == "call":
+                span = watched.get(frame.f_code)
+                if span is not None:
+                    started.append((frame, span, clock()))
+            elif event == "return" and started and started[-1][0] is frame:
+                _, (name, category), start = started.pop()
+                spans[next(slots) % capacity] = (name, category, start, clock() - start, thread)
+
+        sys.setprofile(profile)
+        try:
+            return method(*args, **kwargs)
+        finally:
+            sys.setprofile(None)
+
+    def spans(self):
+        '''
+        The spans currently in the buffer, oldest first
+        '''
+        return sorted((span for span in self._spans if span is not None), key=lambda span: span[2])
+
+    def clear(self):
+        self._spans = [None] * self.capacity
+        self._slots = itertools.count()
+
+    def export(self, path=None):
+        '''
+        Return the buffer as Chrome trace-event JSON, and write it to path if given
+        '''
+        pid = os.getpid()
+        events = [
+            {"name": name, "cat": category, "ph": "X", "ts": start / 1000, "dur": duration / 1000, "pid": pid, "tid": thread}
+            for name, category, start, duration, thread in self.spans()
+        ]
+        trace = json.dumps({"traceEvents": events, "displayTimeUnit": "ms"})
+        if path is not None:
+            with open(path, "w") as file:
+                file.write(trace)
+        return trace
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import tempfile
+
+    class Backend(solid.Transport):
+        '''
+        Answers every request after `latency` seconds, declining verification codes that are not 6 digits
+        '''
+        __slots__ = ("latency",)
+
+        def __init__(self, latency):
+            self.latency = latency
+
+        def send(self, request):
+            if self.latency:
+                time.sleep(self.latency)
+            return {"ok": request["action"] != "verify" or len(request["code"]) == 6}
+
+    def checkouts(backend, number):
+        '''
+        Seconds for `number` SMS verified debit checkouts of two lines each
+        '''
+        authorizer = solid.SMSAuth(backend)
+        processor = solid.DebitPaymentProcesor("2345678", authorizer, backend)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            for _ in range(number):
+                order = solid.Order()
+                order.add_item("Keyboard", 1, 50)
+                order.add_item("SSD", 1, 150)
+                authorizer.verify_code("465839")
+                processor.pay(order)
+            return time.perf_counter() - start
+
+    # Every checkout traced, to see the timeline of one
+    tracer = Tracer()
+    tracer.install()
+    checkouts(Backend(0.0002), 3)
+    tracer.uninstall()
+    names = [span[0] for span in tracer.spans()]
+    for expected in ("SMSAuth.verify_code", "DebitPaymentProcesor.pay", "SMSAuth.is_authorized",
+                     "PaymentProcessor._verify_security_code", "PaymentProcessor._settle", "Backend.send"):
+        if expected not in names:
+            raise Exception(f"No span recorded for {expected}")
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as file:
+        trace = json.loads(tracer.export(file.name))
+    print(f"{len(trace['traceEvents'])} spans for 3 checkouts, open {file.name} in chrome://tracing or Perfetto")
+    first = [span for span in tracer.spans() if span[0] == "DebitPaymentProcesor.pay"][0]
+    for name, _, start, duration, _ in tracer.spans():
+        if first[2] <= start < first[2] + first[3]:
+            print(f"  {(start - first[2]) / 1000:8.1f} us {duration / 1000:8.1f} us  {name}")
+
+    # Overhead against untraced checkouts. Runs alternate and their sums are compared, so drift in machine
+    # speed hits both sides alike. start() keeps its default share of 1 ms a second, scaled down to 0.1 ms
+    # every 100 ms, and in-process its runs are made longer than a period so every run goes through windows.
+    # Timings on a shared machine still vary by a few percent between identical runs, too much to check a 1%
+    # bound against, so start() is checked on the share of checkouts it traced times what tracing costs one.
+    modes = {
+        "every call": (1.0, None),
+        "1% of calls": (0.01, None),
+        "start()": (1.0, (0.1, 0.0001)),
+    }
+    print(f"\n{'backend':<16}{'sampling':<14}{'overhead':>10}{'traced':>9}{'spans':>8}")
+    for label, latency, count in (("in-process", 0.0, 5_000), ("50 us latency", 0.00005, 500)):
+        backend = Backend(latency)
+        for mode, (rate, windows) in modes.items():
+            runs = count * 6 if windows and not latency else count
+            tracer = Tracer(sample_rate=rate)
+            baseline = []
+            traced = []
+            for _ in range(15):
+                baseline.append(checkouts(backend, runs))
+                tracer.start(*windows) if windows else tracer.install()
+                traced.append(checkouts(backend, runs))
+                tracer.stop() if windows else tracer.uninstall()
+            overhead = sum(traced) / sum(baseline) - 1
+            spans = tracer.spans()
+            share = sum(span[0] == "DebitPaymentProcesor.pay" for span in spans) / (15 * runs)
+            print(f"{label:<16}{mode:<14}{overhead:>10.1%}{f'{share:.3%}' if windows else '':>9}{len(spans):>8}")
+            if mode == "every call":
+                traced_cost = overhead
+            elif windows:
+                if not spans:
+                    raise Exception("start() never opened a window")
+                if share * traced_cost > 0.01:
+                    raise Exception(f"start() traces {share:.2%} of checkouts, over 1% overhead at {traced_cost:.0%} each")
@@ -0,0 +1,305 @@
+'''
+    Pooled Transport
+    -----
+    A Transport that keeps connections to the backend alive and reuses them, instead of connecting on every call.
+    One ConnectionPool is shared by all processors and authorizers, with a maximum number of connections per host.
+    Requests are newline delimited JSON, so several requests can be pipelined over one connection with send_many().
+
+    Running this script starts a local socket server and compares pooled against connect-per-call latency.
+'''
+
+import contextlib
+import io
+import json
+import os
+import queue
+import select
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from loader import load
+
+solid = load()
+
+
+class Connection:
+    '''
+    One keep-alive socket speaking newline delimited JSON
+    '''
+
+    def __init__(self, address, timeout=5.0):
+        self.socket = socket.create_connection(address, timeout=timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.socket.makefile("rb")
+
+    def send_many(self, requests, window=128):
+        '''
+        Pipeline the requests, the server answers them in order. At most `window` requests are written ahead of
+        their responses: writing everything first would deadlock once unread responses fill the socket buffers,
+        the server blocking on its writes and the client on its own.
+        '''
+        responses = []
+        for start in range(0, len(requests), window):
+            batch = requests[start:start + window]
+            self.socket.sendall(b"".join(json.dumps(request).encode() + b"\n" for request in batch))
+            for _ in batch:
+                line = self.reader.readline()
+                if not line:
+                    raise ConnectionError("Connection closed by the backend")
+                responses.append(json.loads(line))
+        return responses
+
+    def alive(self):
+        '''
+        Whether the backend kept the connection open while it sat idle. An idle connection has nothing to read,
+        so a readable one was closed by the backend, e.g. after its idle timeout, or holds stray bytes.
+        '''
+        try:
+            readable, _, _ = select.select([self.socket], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def close(self):
+        self.reader.close()
+        self.socket.close()
+
+
+class ConnectionPool:
+    '''
+    Idle connections per (host, port), never more than max_per_host open to one host at a time.
+    An idle connection is checked before it is handed out, one the backend closed is replaced by a new one.
+    '''
+
+    def __init__(self, max_per_host=8, timeout=5.0):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+        self.created = 0
+        self.reused = 0
+        self.waits = 0
+        self.discarded = 0
+        self.expired = 0
+
+    def _host(self, address):
+        with self._lock:
+            if address not in self._slots:
+                self._slots[address] = threading.BoundedSemaphore(self.max_per_host)
+                self._idle[address] = queue.LifoQueue()
+            return self._slots[address], self._idle[address]
+
+    @contextlib.contextmanager
+    def connection(self, address):
+        '''
+        Borrow a connection to address, reusing an idle one when possible
+        '''
+        slots, idle = self._host(address)
+        if not slots.acquire(blocking=False):
+            with self._lock:
+                self.waits += 1
+            if not slots.acquire(timeout=self.timeout):
+                raise TimeoutError(f"No connection to {address} available")
+        try:
+            connection = None
+            while connection is None:
+                try:
+                    connection = idle.get_nowait()
+                except queue.Empty:
+                    connection = Connection(address, self.timeout)
+                    with self._lock:
+                        self.created += 1
+                    break
+                if connection.alive():
+                    with self._lock:
+                        self.reused += 1
+                else:
+                    connection.close()
+                    connection = None
+                    with self._lock:
+                        self.expired += 1
+            try:
+                yield connection
+            except Exception:
+                # The connection may hold half a response, never hand it out again
+                connection.close()
+                with self._lock:
+                    self.discarded += 1
+                raise
+            idle.put(connection)
+        finally:
+            slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hosts": len(self._slots),
+                "idle": sum(idle.qsize() for idle in self._idle.values()),
+                "created": self.created,
+                "reused": self.reused,
+                "waits": self.waits,
+                "discarded": self.discarded,
+                "expired": self.expired,
+            }
+
+    def close(self):
+        for idle in self._idle.values():
+            while not idle.empty():
+                idle.get_nowait().close()
+
+
+class PooledTransport(solid.Transport):
+    '''
+    Transport to one backend address, borrowing connections from a shared pool
+    '''
+
+    __slots__ = ("pool", "address")
+
+    def __init__(self, pool: ConnectionPool, host, port):
+        self.pool = pool
+        self.address = (host, port)
+
+    def send(self, request: dict) -> dict:
+        return self.send_many([request])[0]
+
+    def send_many(self, requests):
+        with self.pool.connection(self.address) as connection:
+            return connection.send_many(requests)
+
+
+class ConnectPerCallTransport(solid.Transport):
+    '''
+    Opens a new connection for every request, the baseline the pool is measured against
+    '''
+
+    __slots__ = ("address",)
+
+    def __init__(self, host, port):
+        self.address = (host, port)
+
+    def send(self, request: dict) -> dict:
+        connection = Connection(self.address)
+        try:
+            return connection.send_many([request])[0]
+        finally:
+            connection.close()
+
+
+class BackendHandler(socketserver.StreamRequestHandler):
+    '''
+    Answers every JSON line on a connection until the client hangs up
+    '''
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        for line in self.rfile:
+            request = json.loads(line)
+            # Gateways echo the caller's reference, so responses can be as large as requests
+            response = {"ok": True, "action": request["action"], "reference": request.get("reference")}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class OneRequestHandler(BackendHandler):
+    '''
+    Answers one request and hangs up, like a backend whose keep-alive timeout passed
+    '''
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        self.wfile.write(json.dumps({"ok": True, "action": request["action"]}).encode() + b"\n")
+
+
+class Backend(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def mean_latency(call, requests, concurrency):
+    '''
+    Mean seconds per call with `concurrency` callers
+    '''
+    def timed(_):
+        start = time.perf_counter()
+        call()
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(timed, range(requests)))
+    return sum(latencies) / len(latencies)
+
+
+if __name__ == "__main__":
+    backend = Backend(("127.0.0.1", 0), BackendHandler)
+    threading.Thread(target=backend.serve_forever, daemon=True).start()
+    host, port = backend.server_address
+
+    pool = ConnectionPool(max_per_host=8)
+    pooled = PooledTransport(pool, host, port)
+    per_call = ConnectPerCallTransport(host, port)
+
+    def checkout(transport):
+        '''
+        One SMS verification and one debit payment, the authorizer and processor share the transport
+        '''
+        def call():
+            authorizer = solid.SMSAuth(transport)
+            authorizer.verify_code(465839)
+            order = solid.Order()
+            order.add_item("SSD", 1, 150)
+            solid.DebitPaymentProcesor("2345678", authorizer, transport).pay(order)
+        return call
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        rows = [
+            (concurrency, mean_latency(checkout(per_call), 2000, concurrency), mean_latency(checkout(pooled), 2000, concurrency))
+            for concurrency in (1, 4, 16)
+        ]
+
+    # A payment in several currencies settles a Decimal amount, which has to survive the JSON wire format
+    rates = load("Performance/fx-rates.py").FxRates()
+    order = solid.Order("USD", rates)
+    order.add_item("SSD", 1, 150)
+    order.add_item("Jacket", 1, 100, "EUR")
+    with contextlib.redirect_stdout(io.StringIO()):
+        solid.CreditPaymentProcesor("0372846", pooled).pay(order)
+    if order.status != "paid" or pool.stats()["discarded"]:
+        raise Exception("A mixed currency payment should go through without losing its connection")
+
+    # Connections the backend closed while they sat idle are replaced instead of failing the next payment
+    closing = Backend(("127.0.0.1", 0), OneRequestHandler)
+    threading.Thread(target=closing.serve_forever, daemon=True).start()
+    expiring = ConnectionPool(max_per_host=1)
+    transport = PooledTransport(expiring, *closing.server_address)
+    for _ in range(3):
+        if not transport.send({"action": "pay", "amount": 1})["ok"]:
+            raise Exception("Every request should be answered")
+        # Give the backend's hang-up time to arrive, as it would over an idle period
+        time.sleep(0.01)
+    if expiring.stats()["expired"] != 2 or expiring.stats()["created"] != 3:
+        raise Exception("Closed idle connections should be detected and replaced")
+    expiring.close()
+    closing.shutdown()
+
+    # Far more than the socket buffers hold, which only completes because the in-flight window is capped
+    requests = [{"action": "pay", "amount": 1, "reference": "x" * 200}] * 100_000
+    start = time.perf_counter()
+    if len(pooled.send_many(requests)) != len(requests):
+        raise Exception("Every pipelined request should get its response")
+    pipelined = (time.perf_counter() - start) / len(requests)
+
+    print(f"{'callers':>8}{'connect per call us':>22}{'pooled us':>12}")
+    for concurrency, baseline, reused in rows:
+        print(f"{concurrency:>8}{baseline * 1e6:>22.0f}{reused * 1e6:>12.0f}")
+    print(f"pipelined: {pipelined * 1e6:.1f} us per request")
+    print(pool.stats())
+
+    pool.close()
+    backend.shutdown()
@@ -0,0 +1,63 @@
+'''
+    Processor Footprint
+    -----
+    Measures the per-instance memory of payment processors with tracemalloc.
+
+    Compares the dict based processors from the composition example against the slotted
+    processors, and against shared() instances for identical configurations.
+
+    shared() only saves memory when the whole configuration repeats, authorizer included. Authorizers hold
+    per-customer state, so with an authorizer per customer every call misses and each processor also costs
+    a cache entry, which the last row measures.
+'''
+
+import tracemalloc
+
+from loader import load
+
+solid = load()
+composition = load("Interface Segregation/interface-segregation-after-composition.py")
+
+COUNT = 100_000
+
+
+def measure(build):
+    '''
+    Return the bytes allocated per processor while COUNT processors are alive
+    '''
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    processors = [build(i) for i in range(COUNT)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del processors
+    return (after - before) / COUNT
+
+
+# Security codes are the same for every instance, only the processor objects are measured
+security_codes = [str(2345678 + i % 10) for i in range(10)]
+sms_authorizer = composition.SMSAuth()
+authorizer = solid.SMSAuth()
+
+with_dict = measure(lambda i: composition.DebitPaymentProcesor(security_codes[i % 10], sms_authorizer))
+with_slots = measure(lambda i: solid.DebitPaymentProcesor(security_codes[i % 10], authorizer))
+shared = measure(lambda i: solid.DebitPaymentProcesor.shared(security_codes[i % 10], authorizer))
+# Authorizers are built up front, so only what the processors add is measured
+customers = [solid.SMSAuth() for _ in range(COUNT)]
+per_customer = measure(lambda i: solid.DebitPaymentProcesor.shared(security_codes[i % 10], customers[i]))
+
+print(f"{'__dict__':<34}{with_dict:>8.1f} bytes per processor")
+print(f"{'__slots__':<34}{with_slots:>8.1f} bytes per processor")
+print(f"{'shared(), one authorizer':<34}{shared:>8.1f} bytes per processor")
+print(f"{'shared(), authorizer per customer':<34}{per_customer:>8.1f} bytes per processor")
+
+if not with_slots < with_dict:
+    raise Exception("Slotted processors are not smaller than dict based processors")
+if not shared < with_slots:
+    raise Exception("Shared processors are not smaller than slotted processors")
+if not per_customer > with_slots:
+    raise Exception("Processors that never repeat should cost their cache entry on top")
+if len(solid.PaymentProcessor._shared) > 10:
+    raise Exception("Cache entries should go away with their processors")
+if hasattr(authorizer, "__dict__"):
+    raise Exception("Authorizers should not carry a __dict__")
@@ -0,0 +1,110 @@
+'''
+    Startup Budget
+    -----
+    Fails when loading the payment module gets slower than its budget.
+
+    A fresh interpreter loads dependency-invertion-after.py under -X importtime. The script times the imports
+    the module pulls in, the time spent executing the module itself (class creation and registration),
+    and the whole process. It also benchmarks processor construction: direct, through the registry,
+    through shared(), and for an equivalent class without ABCMeta.
+'''
+
+import subprocess
+import sys
+import timeit
+
+from loader import ROOT, SOLID, load
+
+# Microseconds, roughly three times what a laptop measures so only real regressions trip them
+BUDGET_US = {
+    "imports": 15_000,
+    "compile": 25_000,
+    "module": 10_000,
+    "process": 150_000,
+}
+
+# Compiles and executes the module by hand, so compiling is timed apart from running it.
+# Compiling only happens when no cached bytecode exists, e.g. with PYTHONDONTWRITEBYTECODE set.
+PROBE = '''
+import sys, time
+sys.stderr.write("-- load\\n")
+with open(sys.argv[1]) as source:
+    start = time.perf_counter()
+    code = compile(source.read(), sys.argv[1], "exec")
+compiled = time.perf_counter()
+exec(code, {"__name__": "solid", "__file__": sys.argv[1]})
+executed = time.perf_counter()
+sys.stderr.write(f"-- loaded {(compiled - start) * 1e6:.0f} {(executed - compiled) * 1e6:.0f}\\n")
+'''
+
+
+def measure():
+    '''
+    Return (import us, compile us, module us, process us, slowest imports) for one fresh interpreter
+    '''
+    start = timeit.default_timer()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE, str(ROOT / SOLID)],
+        capture_output=True, text=True, check=True,
+    )
+    process = (timeit.default_timer() - start) * 1e6
+
+    lines = result.stderr.splitlines()
+    loading = lines[lines.index("-- load") + 1:]
+    imports = []
+    for line in loading:
+        if line.startswith("-- loaded"):
+            compiled, executed = map(int, line.split()[-2:])
+        elif line.startswith("import time:") and "|" in line and not line.endswith("imported package"):
+            _, cumulative, name = line[len("import time:"):].split("|")
+            # Top level imports only, nested ones are already part of their parent's cumulative time
+            if not name.startswith("  ") and cumulative.strip().isdigit():
+                imports.append((int(cumulative), name.strip()))
+    imported = sum(cumulative for cumulative, _ in imports)
+    return imported, compiled, executed - imported, process, sorted(imports, reverse=True)[:5]
+
+
+def construction(number=200_000):
+    '''
+    Nanoseconds per processor for the different ways of building one
+    '''
+    solid = load()
+    authorizer = solid.SMSAuth()
+    # shared() only hits while someone holds the processor, as a long running service would. Even a hit costs
+    # more than building a processor, shared() saves memory rather than time (see processor-footprint.py).
+    held = solid.DebitPaymentProcesor.shared("2345678", authorizer)
+
+    class PlainDebitPaymentProcesor:
+        __slots__ = ("security_code", "authorizer", "transport")
+
+        def __init__(self, security_code, authorizer, transport=None):
+            self.security_code = security_code
+            self.authorizer = authorizer
+            self.transport = transport
+
+    builders = {
+        "DebitPaymentProcesor(...)": lambda: solid.DebitPaymentProcesor("2345678", authorizer),
+        "create_processor(...)": lambda: solid.create_processor("debit", "2345678", authorizer),
+        "DebitPaymentProcesor.shared(...)": lambda: solid.DebitPaymentProcesor.shared("2345678", authorizer),
+        "without ABCMeta": lambda: PlainDebitPaymentProcesor("2345678", authorizer),
+    }
+    timings = {name: timeit.timeit(build, number=number) / number * 1e9 for name, build in builders.items()}
+    del held
+    return timings
+
+
+if __name__ == "__main__":
+    runs = [measure() for _ in range(5)]
+    imported, compiled, module, process, slowest = min(runs, key=lambda run: run[3])
+    measured = {"imports": imported, "compile": compiled, "module": module, "process": process}
+
+    for name, value in measured.items():
+        print(f"{name:<10}{value / 1000:>8.2f} ms  (budget {BUDGET_US[name] / 1000:.0f} ms)")
+    print("slowest imports:", ", ".join(f"{name} {cumulative / 1000:.2f} ms" for cumulative, name in slowest))
+    print()
+    for name, nanoseconds in construction().items():
+        print(f"{name:<34}{nanoseconds:>8.0f} ns")
+
+    over = [name for name, value in measured.items() if value > BUDGET_US[name]]
+    if over:
+        raise Exception(f"Startup budget exceeded for: {', '.join(over)}")
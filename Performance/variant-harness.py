@@ -0,0 +1,168 @@
+'''
+    Variant Harness
+    -----
+    Every before/after example re-implements Order and the payment processors.
+    This harness loads each variant, drives the same randomized order/payment workload through it,
+    checks that total_price() and the final status agree with a reference, and prints a latency/memory table.
+
+    Usage: python variant-harness.py [--orders N] [--seed S]
+'''
+
+import argparse
+import contextlib
+import functools
+import inspect
+import os
+import random
+import time
+import tracemalloc
+
+from loader import ROOT, load
+
+PROCESSOR_NAMES = {
+    "debit": "DebitPaymentProcesor",
+    "credit": "CreditPaymentProcesor",
+    "paypal": "PaypalPaymentProcessor",
+}
+
+ITEMS = ["Keyboard", "SSD", "USB cable", "Monitor", "Mouse", "Headset", "Webcam", "Dock"]
+
+
+def variant_paths():
+    return sorted(
+        path.relative_to(ROOT).as_posix()
+        for path in ROOT.glob("*/*.py")
+        if path.stem.endswith(("-before", "-after")) or "-after-" in path.stem
+    )
+
+
+def supports(module, payment_type):
+    '''
+    Older variants only know debit and credit payments
+    '''
+    if hasattr(module.Order, "pay"):
+        return payment_type in ("debit", "credit")
+    if not hasattr(module, "DebitPaymentProcesor"):
+        return hasattr(module.PaymentProcessor, f"pay_{payment_type}")
+    return hasattr(module, PROCESSOR_NAMES[payment_type])
+
+
+@functools.cache
+def init_params(cls):
+    '''
+    Constructor parameters, cached so signature inspection stays out of the measured latency
+    '''
+    return set(inspect.signature(cls.__init__).parameters)
+
+
+def pay(module, order, payment_type, credential):
+    '''
+    Pay an order through whichever API the variant exposes
+    '''
+    if hasattr(module.Order, "pay"):
+        return order.pay(payment_type, credential)
+    if not hasattr(module, "DebitPaymentProcesor"):
+        return getattr(module.PaymentProcessor(), f"pay_{payment_type}")(order, credential)
+
+    cls = getattr(module, PROCESSOR_NAMES[payment_type])
+    params = init_params(cls)
+    if "authorizer" in params:
+        authorizer = module.SMSAuth()
+        authorizer.verify_code(465839)
+        return cls(credential, authorizer).pay(order)
+    if "security_code" in params or "email_address" in params:
+        processor = cls(credential)
+        if payment_type != "credit" and hasattr(processor, "auth_sms"):
+            processor.auth_sms(465839)
+        return processor.pay(order)
+    return cls().pay(order, credential)
+
+
+def workload(count, seed):
+    '''
+    Build the randomized requests shared by every variant, as (lines, payment type, credential)
+    '''
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(count):
+        lines = [(rng.choice(ITEMS), rng.randint(1, 5), rng.randint(1, 500)) for _ in range(rng.randint(1, 10))]
+        payment_type = rng.choice(list(PROCESSOR_NAMES))
+        credential = "monkey@gmail.com" if payment_type == "paypal" else str(rng.randint(1000000, 9999999))
+        requests.append((lines, payment_type, credential))
+    return requests
+
+
+def run(module, requests):
+    '''
+    Drive the workload through one variant, returning results and per-request latencies
+    '''
+    results = []
+    latencies = []
+    for lines, payment_type, credential in requests:
+        if not supports(module, payment_type):
+            results.append(None)
+            continue
+        start = time.perf_counter_ns()
+        order = module.Order()
+        for name, quantity, price in lines:
+            order.add_item(name, quantity, price)
+        total = order.total_price()
+        pay(module, order, payment_type, credential)
+        latencies.append(time.perf_counter_ns() - start)
+        results.append((total, order.status))
+    return results, latencies
+
+
+def memory_per_order(module, requests):
+    '''
+    Bytes held per order while the whole workload is alive, measured separately as tracemalloc slows allocation down
+    '''
+    tracemalloc.start()
+    orders = []
+    for lines, _, _ in requests:
+        order = module.Order()
+        for name, quantity, price in lines:
+            order.add_item(name, quantity, price)
+        orders.append(order)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return memory / len(orders)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    requests = workload(args.orders, args.seed)
+    expected = [(sum(q * p for _, q, p in lines), "paid") for lines, _, _ in requests]
+
+    rows = []
+    mismatches = []
+    with open(os.devnull, "w") as devnull:
+        for path in variant_paths():
+            module = load(path, tolerate_errors=True)
+            with contextlib.redirect_stdout(devnull):
+                results, latencies = run(module, requests)
+            memory = memory_per_order(module, requests)
+            for index, result in enumerate(results):
+                if result is not None and result != expected[index]:
+                    mismatches.append(f"{path}: request {index} gave {result}, expected {expected[index]}")
+            rows.append((path, len(latencies), sum(latencies) / len(latencies), percentile(latencies, 0.99), memory))
+
+    print(f"{'variant':<68}{'orders':>8}{'mean us':>10}{'p99 us':>10}{'bytes/order':>13}")
+    for path, count, mean, p99, memory in sorted(rows, key=lambda row: row[2]):
+        print(f"{path:<68}{count:>8}{mean / 1000:>10.2f}{p99 / 1000:>10.2f}{memory:>13.0f}")
+
+    if mismatches:
+        raise Exception("Variants disagree:\n" + "\n".join(mismatches[:20]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+'''
+    Velocity Authorizer
+    -----
+    An Authorizer that declines a card or email once it has made too many payments in a sliding window.
+
+    SlidingWindowCounter keeps a ring of count-min sketches, one per slice of the window plus a spare, so memory
+    is fixed however many distinct keys are seen. Recording and estimating are O(slices * depth) regardless of
+    the number of keys. Moving to the next slice only rotates the ring: the slice falling out of the window
+    becomes the spare, which is zeroed a chunk at a time by the calls that follow, so no single payment pays
+    for compacting the whole sketch.
+    Count-min sketches never undercount, collisions can only make a key look busier than it is. Calls are
+    serialized by a lock, so concurrent payments on one key are all counted.
+'''
+
+import operator
+import threading
+import time
+from array import array
+
+from loader import load
+
+solid = load()
+
+
+class SlidingWindowCounter:
+    '''
+    Approximate per key counts over the last `window` seconds, in `slices` steps.
+    A key's count in one row is the sum of its counter in every slice of the window. The spare slice
+    after the current one is out of the window, every call zeroes the next `zero_chunk` of its counters.
+    '''
+
+    def __init__(self, window=60.0, slices=6, width=1 << 16, depth=4, clock=time.monotonic, zero_chunk=1 << 14):
+        self.slice_length = window / slices
+        self.width = width
+        self.depth = depth
+        self.clock = clock
+        self.zero_chunk = zero_chunk
+        self._size = width * depth
+        self._sketches = [array("I", bytes(4 * self._size)) for _ in range(slices + 1)]
+        self._zero = memoryview(array("I", bytes(4 * self._size)))
+        self._current = 0
+        # The slices in the window, every sketch but the spare
+        self._window = self._sketches[:1] + self._sketches[2:]
+        # How far the spare slice has been zeroed, it starts out clean
+        self._zeroed = self._size
+        self._slice_started = clock()
+        self._lock = threading.Lock()
+
+    def _indexes(self, key):
+        '''
+        One counter per row, derived from a single hash (double hashing)
+        '''
+        h = hash(key)
+        h1 = h & 0xFFFFFFFF
+        h2 = ((h >> 32) & 0xFFFFFFFF) | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def _zero_spare(self, chunk):
+        start = self._zeroed
+        end = min(self._size, start + chunk)
+        spare = self._sketches[(self._current + 1) % len(self._sketches)]
+        memoryview(spare)[start:end] = self._zero[start:end]
+        self._zeroed = end
+
+    def _advance(self):
+        '''
+        Move to the slice the clock is in, zeroing the next chunk of the spare slice on the way.
+        The spare becomes the current slice and the slice falling out of the window the new spare.
+        Only a spare that calls have not finished zeroing within a whole slice is zeroed here at once.
+        '''
+        elapsed = int((self.clock() - self._slice_started) / self.slice_length)
+        if elapsed > 0:
+            self._slice_started += elapsed * self.slice_length
+            # After a whole window without calls every slice is expired, each one is zeroed once
+            for _ in range(min(elapsed, len(self._sketches))):
+                if self._zeroed < self._size:
+                    self._zero_spare(self._size)
+                self._current = (self._current + 1) % len(self._sketches)
+                self._zeroed = 0
+            spare = (self._current + 1) % len(self._sketches)
+            self._window = self._sketches[:spare] + self._sketches[spare + 1:]
+        if self._zeroed < self._size:
+            self._zero_spare(self.zero_chunk)
+
+    def add(self, key, count=1):
+        '''
+        Record `count` events for key and return its estimated count over the window.
+        Conservative update: only counters that would fall below the new estimate are raised,
+        which keeps collisions from inflating the other keys' counts more than necessary.
+        '''
+        indexes = self._indexes(key)
+        with self._lock:
+            self._advance()
+            window = self._window
+            current = self._sketches[self._current]
+            counts = [sum(map(operator.itemgetter(index), window)) for index in indexes]
+            estimate = min(counts) + count
+            for index, counted in zip(indexes, counts):
+                if counted < estimate:
+                    current[index] += estimate - counted
+        return estimate
+
+    def estimate(self, key):
+        indexes = self._indexes(key)
+        with self._lock:
+            self._advance()
+            window = self._window
+            return min(sum(map(operator.itemgetter(index), window)) for index in indexes)
+
+    def memory(self):
+        return sum(sketch.itemsize * len(sketch) for sketch in self._sketches) + self._zero.nbytes
+
+
+class VelocityAuthorizer(solid.Authorizer):
+    '''
+    Authorizes a payment only while `key` (a card number or email) stays within `limit` payments per window.
+    Every is_authorized() call counts as one payment attempt, processors call it once per payment.
+    An inner authorizer, e.g. SMSAuth, must also agree.
+    '''
+
+    __slots__ = ("counter", "key", "limit", "inner")
+
+    def __init__(self, counter: SlidingWindowCounter, key, limit, inner: solid.Authorizer = None):
+        self.counter = counter
+        self.key = key
+        self.limit = limit
+        self.inner = inner
+
+    def is_authorized(self) -> bool:
+        if self.inner is not None and not self.inner.is_authorized():
+            return False
+        return self.counter.add(self.key) <= self.limit
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import random
+    import sys
+    from collections import deque
+
+    # A paypal account making a burst of payments is declined after the fifth one within a minute
+    now = [0.0]
+    counter = SlidingWindowCounter(window=60, clock=lambda: now[0])
+    sms = solid.SMSAuth()
+    sms.authorized = True
+    processor = solid.PaypalPaymentProcessor("monkey@gmail.com", VelocityAuthorizer(counter, "monkey@gmail.com", 5, sms))
+    declined = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(8):
+            order = solid.Order()
+            order.add_item("SSD", 1, 150)
+            try:
+                processor.pay(order)
+            except Exception:
+                declined += 1
+        now[0] += 61
+        processor.pay(order)
+    if declined != 3:
+        raise Exception(f"Expected 3 declined payments, got {declined}")
+
+    # Counts leave the window slice by slice, also when the spare is still being zeroed as the clock moves on
+    rng = random.Random(1)
+    now[0] = 0.0
+    counter = SlidingWindowCounter(window=60, slices=6, width=1 << 12, depth=4, clock=lambda: now[0], zero_chunk=64)
+    events = []
+    for _ in range(3000):
+        now[0] += rng.choice((0.0, 0.1, 1.0, 7.0, 25.0))
+        key = f"card-{rng.randrange(20)}"
+        events.append((now[0], key))
+        counter.add(key)
+        # The window covers the current slice and the 5 before it
+        since = (now[0] // 10 - 5) * 10
+        exact = sum(1 for at, seen in events if seen == key and at >= since)
+        if counter.estimate(key) != exact:
+            raise Exception(f"Estimated {counter.estimate(key)} payments for {key}, made {exact}")
+
+    # Concurrent payments on the same keys are all counted
+    counter = SlidingWindowCounter(width=1 << 12)
+    payments = [f"card-{i}" for i in range(50)] * 400
+    threads = [threading.Thread(target=lambda: [counter.add(key) for key in payments]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if any(counter.estimate(f"card-{i}") < 8 * 400 for i in range(50)):
+        raise Exception("Concurrent adds were lost")
+
+    # Throughput and memory at millions of distinct keys, against exact per key timestamp queues
+    keys = [f"card-{i}" for i in range(2_000_000)]
+
+    counter = SlidingWindowCounter(slices=4, width=1 << 21, depth=3)
+    start = time.perf_counter()
+    for key in keys:
+        counter.add(key)
+    sketch_seconds = time.perf_counter() - start
+
+    exact = {}
+    start = time.perf_counter()
+    for key in keys:
+        timestamps = exact.get(key)
+        if timestamps is None:
+            timestamps = exact[key] = deque()
+        timestamps.append(time.monotonic())
+    exact_seconds = time.perf_counter() - start
+    exact_memory = sys.getsizeof(exact) + sum(sys.getsizeof(value) + 24 for value in exact.values())
+    del exact
+
+    # The slowest payments right after the clock moves into the next slice
+    counter.clock = lambda: time.monotonic() + counter.slice_length
+    slowest = 0.0
+    for key in keys[:10_000]:
+        start = time.perf_counter()
+        counter.add(key)
+        slowest = max(slowest, time.perf_counter() - start)
+    counter.clock = time.monotonic
+
+    sample = random.Random(1).sample(keys, 10_000)
+    estimates = [counter.estimate(key) for key in sample]
+    overcounted = sum(estimate > 1 for estimate in estimates) / len(sample)
+    falsely_declined = sum(estimate > 5 for estimate in estimates) / len(sample)
+
+    print(f"{'':<16}{'adds/s':>12}{'memory MB':>12}")
+    print(f"{'count-min ring':<16}{len(keys) / sketch_seconds:>12.0f}{counter.memory() / 1e6:>12.1f}")
+    print(f"{'exact deques':<16}{len(keys) / exact_seconds:>12.0f}{exact_memory / 1e6:>12.1f}")
+    print(f"slowest add across a slice change: {slowest * 1e6:.0f} us")
+    print(f"at {len(keys):,} distinct keys with one payment each: {overcounted:.2%} overcounted, "
+          f"{falsely_declined:.2%} over a limit of 5")